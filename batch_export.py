@@ -0,0 +1,209 @@
+"""
+Renders graphs without a terminal, for making lots of plots at once.
+Run with `python batch_export.py [jobs file] [--processes N]`, jobs are read from stdin if no file (or -) is given.
+
+Each line of the jobs is a JSON object describing one graph, e.g.
+    {"equations": [["y", "x**2"], ["x**2+y**2", "1"]], "output": "circle.png", "view": [-2, 2, 2, -2], "size": [80, 24]}
+Only equations and output are needed. The others are
+    view: the [left, right, top, bottom] of the graph world to show, [-2, 2, 2, -2] by default.
+    size: the [width, height] of the graph in characters, [80, 24] by default.
+    mode: one of graph_rendering_utils.RENDER_MODES, uniform by default.
+    resolution: one of layer.RESOLUTIONS, cell by default.
+    scale: how many pixels wide and high each sample is in a PNG, 1 by default.
+Outputs ending in .png are written as a black on white PNG with a pixel per sample, anything else is written as the
+text the graph would be drawn with in a window.
+Jobs with more than MAX_SAMPLES samples (the size times the resolution), or PNGs with more than MAX_PNG_PIXELS pixels
+(the samples times scale squared), are rejected as bad jobs.
+
+Jobs are read and rendered a few at a time in a process pool, so any number of them can be run with little memory.
+The output path of each job is printed as it finishes, and problems are printed to stderr. If a process dies while
+rendering (e.g. it is killed for running out of memory), the pool is started again and its jobs are run again one at
+a time, so only the job that killed it fails.
+"""
+import collections
+import concurrent.futures
+import json
+import os
+import struct
+import sys
+import zlib
+
+from concurrent.futures.process import BrokenProcessPool
+
+from equation import compile_equation
+from graph_rendering_utils import render_equations, render_equations_layer, UNIFORM, RENDER_MODES
+from layer import Layer, CELL, RESOLUTIONS
+from offscreen import OffscreenWindow
+
+JOBS_PER_PROCESS = 2
+"""
+How many jobs are given to the process pool at once for each process, more than this are not read until some finish.
+"""
+MAX_SAMPLES = 4_000_000
+"""
+The most samples a job can render, e.g. 2000x2000, so a job can't take more than a few hundred MB.
+"""
+MAX_PNG_PIXELS = 16_000_000
+"""
+The most pixels a PNG can have, e.g. 4000x4000 which is 16MB before compressing.
+"""
+
+
+def write_png(path: str, layer: Layer, scale: int = 1):
+    """
+    Write a layer to a PNG, with drawn cells black on a white background, and each cell scale * scale pixels.
+    """
+    width, height = layer.width * scale, layer.height * scale
+    scanlines = bytearray()
+    for row in layer.rows:
+        line = b"\x00" + bytes(0 if row >> (x // scale) & 1 else 255 for x in range(width))  # No filter, then grey levels
+        scanlines += line * scale
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    with open(path, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        file.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)))  # 8 bit greyscale
+        file.write(chunk(b"IDAT", zlib.compress(bytes(scanlines))))
+        file.write(chunk(b"IEND", b""))
+
+
+def export_job(line: str) -> str:
+    """
+    Render the job in the given line of JSON and write it to its output, returning the output path.
+    Raises ValueError if the job isn't valid.
+    """
+    try:
+        job = json.loads(line)
+        equations = [(str(lhs), str(rhs)) for lhs, rhs in job["equations"]]
+        output = job["output"]
+        view_left, view_right, view_top, view_bottom = (float(value) for value in job.get("view", (-2, 2, 2, -2)))
+        width, height = (int(value) for value in job.get("size", (80, 24)))
+        scale = int(job.get("scale", 1))
+        mode, resolution = job.get("mode", UNIFORM), job.get("resolution", CELL)
+    except (ValueError, TypeError, KeyError, AttributeError) as e:  # AttributeError if the line isn't an object
+        raise ValueError(f"Bad job: {e!r}")
+    if not isinstance(output, str):
+        raise ValueError(f"Bad job: Output must be a string, not {output!r}")
+    if mode not in RENDER_MODES:
+        raise ValueError(f"{output}: Mode must be one of {', '.join(RENDER_MODES)}, not {mode!r}")
+    if resolution not in tuple(RESOLUTIONS):  # Not the dict itself, so unhashable values are just not found
+        raise ValueError(f"{output}: Resolution must be one of {', '.join(RESOLUTIONS)}, not {resolution!r}")
+    if width < 2 or height < 2:
+        raise ValueError(f"{output}: Size must be at least 2x2")
+    if scale < 1:
+        raise ValueError(f"{output}: Scale must be at least 1")
+    samples = width * RESOLUTIONS[resolution][0] * height * RESOLUTIONS[resolution][1]
+    if samples > MAX_SAMPLES:
+        raise ValueError(f"{output}: Size has {samples} samples at {resolution} resolution, more than the {MAX_SAMPLES} allowed")
+    if output.lower().endswith(".png") and samples * scale ** 2 > MAX_PNG_PIXELS:
+        raise ValueError(f"{output}: Scale gives {samples * scale ** 2} pixels, more than the {MAX_PNG_PIXELS} allowed")
+    for source in equations:
+        if not compile_equation(source).valid:
+            raise ValueError(f"{output}: {'='.join(source)} {compile_equation(source).error}")
+
+    if output.lower().endswith(".png"):
+        layer = render_equations_layer(equations, view_left, view_right, view_top, view_bottom, width, height, mode=mode, resolution=resolution)
+        write_png(output, layer, scale)
+    else:
+        window = OffscreenWindow([], width + 1, height)  # A spare column, as curses can't draw the bottom right cell
+        render_equations(equations, window, view_left, view_right, view_top, view_bottom, 0, 0, width, height, mode=mode, resolution=resolution)
+        with open(output, "w") as file:
+            file.write("\n".join(line[:width].rstrip() for line in window.get_lines()) + "\n")
+    return output
+
+
+def get_output(line: str) -> str:
+    """
+    The output path of the job in the given line, or "Bad job" if it doesn't have one.
+    """
+    try:
+        output = json.loads(line)["output"]
+    except (ValueError, TypeError, KeyError):
+        return "Bad job"
+    return output if isinstance(output, str) else "Bad job"
+
+
+def export_jobs(lines, process_count: int) -> int:
+    """
+    Run the job on each of the given lines (blank ones are skipped), in a pool of the given number of processes.
+    Lines are only taken from the iterable as jobs finish. Returns how many jobs failed.
+    """
+    failures = 0
+    jobs = {}  # The line each running job was read from, and if it is being run again after its process died
+    running = set()
+    to_retry = collections.deque()  # Jobs whose process died, as any job in the pool fails when one kills its process
+    # The pool jobs are run in, and a pool of one process that runs jobs again one at a time, so only the job that
+    # kills it fails
+    pools = {False: None, True: None}
+
+    def submit(line: str, retried: bool):
+        while True:
+            if pools[retried] is None:
+                pools[retried] = concurrent.futures.ProcessPoolExecutor(1 if retried else process_count)
+            try:
+                future = pools[retried].submit(export_job, line)
+                break
+            except BrokenProcessPool:  # A process died, so the pool won't take any more jobs
+                pools[retried].shutdown(wait=False)
+                pools[retried] = None
+        jobs[future] = (line, retried)
+        running.add(future)
+
+    def report(future):
+        nonlocal failures
+        line, retried = jobs.pop(future)
+        try:
+            print(future.result(), flush=True)
+        except BrokenProcessPool as e:
+            if not retried:
+                to_retry.append(line)
+                return
+            failures += 1
+            print(f"{get_output(line)}: The process rendering it died, it may need too much memory: {e!r}", file=sys.stderr, flush=True)
+        except (ValueError, OSError) as e:  # Already say which job they are from
+            failures += 1
+            print(e, file=sys.stderr, flush=True)
+        except Exception as e:  # Anything else a job raises (e.g. RecursionError) only fails that job
+            failures += 1
+            print(f"{get_output(line)}: {e!r}", file=sys.stderr, flush=True)
+
+    def wait_for_one():
+        nonlocal running
+        if to_retry and not any(jobs[future][1] for future in running):
+            submit(to_retry.popleft(), True)
+        done, running = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            report(future)
+
+    try:
+        for line in lines:
+            if line.strip() == "":
+                continue
+            while len(running) >= process_count * JOBS_PER_PROCESS:  # Wait for space before reading any more
+                wait_for_one()
+            submit(line, False)
+        while running or to_retry:
+            wait_for_one()
+    finally:
+        for pool in pools.values():
+            if pool is not None:
+                pool.shutdown()
+    return failures
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    process_count = os.cpu_count() or 1
+    if "--processes" in arguments:
+        index = arguments.index("--processes")
+        process_count = int(arguments[index + 1])
+        del arguments[index:index + 2]
+
+    if not arguments or arguments[0] == "-":
+        failure_count = export_jobs(sys.stdin, process_count)
+    else:
+        with open(arguments[0]) as jobs_file:
+            failure_count = export_jobs(jobs_file, process_count)
+    sys.exit(1 if failure_count else 0)
@@ -0,0 +1,168 @@
+"""
+Benchmarks for the console graphing program, these draw to offscreen windows so they run without a terminal.
+Run with `python benchmarks.py`, or `python benchmarks.py calls render frames` to only run some of them.
+"""
+import collections
+import statistics
+import sys
+import time
+
+from equation import compile_equation
+from graph_rendering_utils import render_equation, TILE_WIDTH
+from main import EquationEditor, TopBar, BottomBar, GraphViewer
+from offscreen import OffscreenScreen, OffscreenWindow
+from window import RIGHT_ARROW
+
+SIZES = [(80, 24), (160, 48), (240, 72), (400, 120)]
+"""
+The (width, height) of the windows to benchmark at.
+"""
+EQUATION_MIXES = {
+    "linear": [("y", "2 * x + 1")],
+    "circle": [("x**2 + y**2", "1")],
+    "polynomial": [("y", "x**5 - 2*x**3 + 1*x**2 - x - 1")],
+    "trig": [("y", "sin(3 * x) * cos(2 * x)")],
+    "all": [("y", "2 * x + 1"), ("x**2 + y**2", "1"), ("y", "x**5 - 2*x**3 + 1*x**2 - x - 1"), ("y", "sin(3 * x) * cos(2 * x)")],
+}
+"""
+The sets of equations to benchmark with.
+"""
+
+
+class CountingScreen(OffscreenScreen):
+    """
+    An OffscreenScreen that also counts how many times each drawing call is made.
+    """
+
+    calls: collections.Counter
+
+    def __init__(self, width: int, height: int):
+        super().__init__(width, height)
+        self.calls = collections.Counter()
+
+    def addstr(self, y, x, text):
+        self.calls["addstr"] += 1
+        super().addstr(y, x, text)
+
+    def addch(self, y, x, char):
+        self.calls["addch"] += 1
+        super().addstr(y, x, char)
+
+    def attron(self, attribute):
+        self.calls["attron"] += 1
+        super().attron(attribute)
+
+
+class CountingWindow(OffscreenWindow):
+    """
+    An OffscreenWindow that draws to a CountingScreen.
+    """
+
+    def __init__(self, widgets, width: int, height: int):
+        super().__init__(widgets, width, height, CountingScreen(width, height))
+
+    def count_frame(self) -> collections.Counter:
+        """
+        Draw every widget once, and return how many of each curses call that took.
+        """
+        self._stdscr.calls.clear()
+        self.draw_frame()
+        return collections.Counter(self._stdscr.calls)
+
+
+class LegacyCountingWindow(CountingWindow):
+    """
+    A CountingWindow with the drawing functions as they were before writes were batched, to compare against.
+    """
+
+    def _set_color(self, foreground_color, background_color):
+        self._stdscr.attron(self._get_color_attribute((foreground_color, background_color)))
+
+    def draw_rectangle(self, x, y, width, height, color=None):
+        if color is not None:
+            self._set_color(0, color)
+        for row in range(y, y + height):
+            self._stdscr.addstr(row, x, " " * width)
+
+    def overlay_text(self, x, y, text, foreground_color, background_color):
+        self._set_color(foreground_color, background_color)
+        for line in text:
+            for n, char in enumerate(line):
+                if char != " ":
+                    self._stdscr.addch(y, x + n, char)
+            y += 1
+
+
+def make_widgets(equations: list[tuple[str, str]]) -> list:
+    """
+    The same widgets that main.py uses, with the graph rendered on the calling thread.
+    """
+    return [EquationEditor(equations), TopBar(), BottomBar(), GraphViewer(equations, asynchronous=False)]
+
+
+def percentiles(times: list[float]) -> str:
+    """
+    Format the 50th, 90th and 99th percentiles of the given times in milliseconds.
+    """
+    cuts = statistics.quantiles(times, n=100, method="inclusive")
+    return f"p50 {cuts[49] * 1000:8.2f}ms  p90 {cuts[89] * 1000:8.2f}ms  p99 {cuts[98] * 1000:8.2f}ms"
+
+
+def benchmark_curses_calls(sizes: list[tuple[int, int]], equations: list[tuple[str, str]]):
+    """
+    Print how many curses calls a full frame takes at each (width, height), before and after batching.
+    """
+    print(f"{'size':>10} {'before':>8} {'after':>8}   after by call")
+    for width, height in sizes:
+        before = LegacyCountingWindow(make_widgets(equations), width, height).count_frame()
+        after = CountingWindow(make_widgets(equations), width, height).count_frame()
+        print(f"{str(width) + 'x' + str(height):>10} {sum(before.values()):>8} {sum(after.values()):>8}   {dict(after)}")
+
+
+def benchmark_render_equation(sizes: list[tuple[int, int]], mixes: dict[str, list[tuple[str, str]]], repeats: int = 20):
+    """
+    Print how long render_equation takes for each equation mix at each canvas (width, height).
+    """
+    for width, height in sizes:
+        for name, equations in mixes.items():
+            compiled = [compile_equation(source) for source in equations]
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                for equation in compiled:
+                    render_equation(equation, -2, 2, 2, -2, width, height)
+                times.append(time.perf_counter() - start)
+            print(f"{str(width) + 'x' + str(height):>10} {name:>12}   {percentiles(times)}")
+
+
+def benchmark_frames(sizes: list[tuple[int, int]], mixes: dict[str, list[tuple[str, str]]], frames: int = 20):
+    """
+    Print how long full frames of main.py's widgets take, for each equation mix at each window (width, height).
+    The graph is panned by more than the window and a tile before each frame, so that none of the tiles of the last
+    frame can be reused and it has to be rendered again.
+    """
+    for width, height in sizes:
+        for name, equations in mixes.items():
+            widgets = make_widgets(list(equations))
+            window = OffscreenWindow(widgets, width, height)
+            times = []
+            for _ in range(frames):
+                for _ in range(width + TILE_WIDTH):
+                    widgets[3].handle_key(RIGHT_ARROW)
+                start = time.perf_counter()
+                window.draw_frame()
+                times.append(time.perf_counter() - start)
+            print(f"{str(width) + 'x' + str(height):>10} {name:>12}   {percentiles(times)}")
+
+
+if __name__ == "__main__":
+    benchmarks = sys.argv[1:] or ["calls", "render", "frames"]
+    if "calls" in benchmarks:
+        print("Curses calls per frame")
+        benchmark_curses_calls(SIZES, EQUATION_MIXES["all"])
+    if "render" in benchmarks:
+        print("render_equation latency")
+        benchmark_render_equation(SIZES, EQUATION_MIXES)
+    if "frames" in benchmarks:
+        print("Full frame latency")
+        benchmark_frames(SIZES, EQUATION_MIXES)
@@ -0,0 +1,367 @@
+import ast
+import functools
+import math
+import typing
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional, without it only the scalar evaluate can be used
+    numpy = None
+
+
+def _floor(value: float) -> float:
+    return float(math.floor(value))
+
+
+def _ceil(value: float) -> float:
+    return float(math.ceil(value))
+
+
+FUNCTIONS = {
+    # name: (scalar implementation, NumPy implementation name, number of arguments)
+    "sin": (math.sin, "sin", 1),
+    "cos": (math.cos, "cos", 1),
+    "tan": (math.tan, "tan", 1),
+    "asin": (math.asin, "arcsin", 1),
+    "acos": (math.acos, "arccos", 1),
+    "atan": (math.atan, "arctan", 1),
+    "sinh": (math.sinh, "sinh", 1),
+    "cosh": (math.cosh, "cosh", 1),
+    "tanh": (math.tanh, "tanh", 1),
+    "exp": (math.exp, "exp", 1),
+    "log": (math.log, "log", 1),
+    "log10": (math.log10, "log10", 1),
+    "sqrt": (math.sqrt, "sqrt", 1),
+    "abs": (abs, "abs", 1),
+    "floor": (_floor, "floor", 1),  # These give floats like the rest, as ints can be raised to powers without overflowing
+    "ceil": (_ceil, "ceil", 1),
+}
+"""
+The functions that may be used in equations.
+"""
+CONSTANTS = {"pi": math.pi, "e": math.e, "tau": math.tau}
+"""
+The named constants that may be used in equations.
+"""
+VARIABLES = ("x", "y")
+MAX_NESTING = 100
+"""
+How deeply operators and function calls may be nested in one side of an equation. Equations are compiled, vectorized
+and turned into interval functions by walking their trees recursively, so anything much deeper would hit Python's
+recursion limit.
+"""
+
+_ALLOWED_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.UAdd, ast.USub)
+_CAUGHT_ERRORS = (ArithmeticError, ValueError, TypeError)  # What the maths can raise for points it isn't defined at
+
+
+class EquationError(ValueError):
+    """
+    Raised when the text of an equation is not something we are able to evaluate.
+    """
+
+
+def parse_expression(text: str) -> ast.expr:
+    """
+    Parse one side of an equation, only allowing arithmetic, x, y, and the FUNCTIONS and CONSTANTS.
+    Raises EquationError with a short description for anything else.
+    Numbers are all turned into floats, so powers that are too big raise OverflowError rather than building an int
+    with millions of digits (e.g. 9**9**9).
+    """
+    if text.strip() == "":
+        raise EquationError("Empty side")
+    try:
+        tree = ast.parse(text.strip(), mode="eval").body
+    except SyntaxError:
+        raise EquationError("Syntax error")
+    except (RecursionError, MemoryError):  # Nested too deeply for the parser
+        raise EquationError("Too long")
+
+    depths = [(tree, 0)]  # Checked without recursing, so it works however deep the tree is
+    while depths:
+        node, depth = depths.pop()
+        if depth > MAX_NESTING:
+            raise EquationError("Too long")
+        depths.extend((child, depth + 1) for child in ast.iter_child_nodes(node) if isinstance(child, ast.expr))
+
+    called = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.BinOp, ast.UnaryOp)):
+            if not isinstance(node.op, _ALLOWED_OPERATORS):
+                raise EquationError("Bad operator")
+        elif isinstance(node, ast.Constant):
+            if type(node.value) not in (int, float):
+                raise EquationError("Bad constant")
+            try:
+                node.value = float(node.value)
+            except OverflowError:
+                raise EquationError("Number too big")
+        elif isinstance(node, ast.Name):
+            if node.id in FUNCTIONS:
+                if id(node) not in called:
+                    raise EquationError(f"{node.id} needs brackets")
+            elif node.id not in VARIABLES and node.id not in CONSTANTS:
+                raise EquationError(f"Unknown name {node.id}")
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+                raise EquationError("Unknown function")
+            if node.keywords or len(node.args) != FUNCTIONS[node.func.id][2]:
+                raise EquationError(f"Bad arguments to {node.func.id}")
+        elif not isinstance(node, (ast.Load, ast.operator, ast.unaryop)):
+            raise EquationError("Not allowed")
+
+    return tree
+
+
+def build_function(body: ast.expr, namespace: dict, catch: bool, caught_result: typing.Any = False, statements: list[ast.stmt] = ()):
+    """
+    Compile the given validated expression into a function of (x, y) whose globals are only the given namespace.
+    If catch is true then the function returns caught_result instead of raising for points the maths isn't defined at
+    (e.g. log(-1) or 1/0).
+    Any statements given are run first, so the expression can use the variables they assign.
+    """
+    if catch:
+        statement = ast.Try(
+            body=[*statements, ast.Return(body)],
+            handlers=[ast.ExceptHandler(type=ast.Name("_CAUGHT_ERRORS", ast.Load()), name=None, body=[ast.Return(ast.Name("_CAUGHT_RESULT", ast.Load()))])],
+            orelse=[],
+            finalbody=[]
+        )
+        statements = [statement]
+    else:
+        statements = [*statements, ast.Return(body)]
+    function = ast.FunctionDef(
+        name="equation",
+        args=ast.arguments(posonlyargs=[], args=[ast.arg("x"), ast.arg("y")], kwonlyargs=[], kw_defaults=[], defaults=[]),
+        body=statements,
+        decorator_list=[]
+    )
+    module = ast.fix_missing_locations(ast.Module(body=[function], type_ignores=[]))
+    namespace = {"__builtins__": {}, "_CAUGHT_ERRORS": _CAUGHT_ERRORS, "_CAUGHT_RESULT": caught_result, **namespace}
+    exec(compile(module, "<equation>", "exec"), namespace)
+    return namespace["equation"]
+
+
+def share_subexpressions(trees: list[ast.expr]) -> tuple[list[ast.stmt], list[ast.expr]]:
+    """
+    Split the given validated expressions into statements that compute every distinct subexpression once, assigning
+    it to a variable, and an expression for each tree that reads its result from those variables.
+    Subexpressions are the same if they have the same operator or function and operands, where the operands of + and
+    * can be in either order, as swapping them gives exactly the same result.
+    """
+    statements = []
+    variables = {}  # The name of the variable that holds each distinct subexpression
+
+    def share(node: ast.expr) -> ast.expr:
+        if isinstance(node, (ast.Name, ast.Constant)):
+            return node  # Already free to read
+        if isinstance(node, ast.BinOp):
+            operands = [share(node.left), share(node.right)]
+            expression = ast.BinOp(operands[0], node.op, operands[1])
+            operator = node.op
+        elif isinstance(node, ast.UnaryOp):
+            operands = [share(node.operand)]
+            expression = ast.UnaryOp(node.op, operands[0])
+            operator = node.op
+        elif isinstance(node, ast.Compare):
+            operands = [share(node.left), share(node.comparators[0])]
+            expression = ast.Compare(operands[0], node.ops, [operands[1]])
+            operator = node.ops[0]
+        else:  # A call, as the trees have been validated
+            operands = [share(argument) for argument in node.args]
+            expression = ast.Call(ast.Name(node.func.id, ast.Load()), operands, [])
+            operator = node.func.id
+
+        key = [ast.dump(operand) for operand in operands]
+        if isinstance(operator, (ast.Add, ast.Mult)):
+            key.sort()
+        key = (ast.dump(operator) if isinstance(operator, ast.AST) else operator, *key)
+        if key not in variables:
+            variables[key] = f"_shared{len(variables)}"
+            statements.append(ast.Assign([ast.Name(variables[key], ast.Store())], expression))
+        return ast.Name(variables[key], ast.Load())
+
+    results = [share(tree) for tree in trees]
+    return statements, results
+
+
+def scalar_namespace() -> dict:
+    """
+    The names available to equations when evaluating one point at a time.
+    """
+    return {**CONSTANTS, **{name: f[0] for name, f in FUNCTIONS.items()}}
+
+
+def grid_namespace() -> dict:
+    """
+    The names available to equations when evaluating NumPy arrays.
+    """
+    return {**CONSTANTS, **{name: getattr(numpy, f[1]) for name, f in FUNCTIONS.items()}}
+
+
+class CompiledEquation:
+    """
+    An equation of the form lhs=rhs that has been parsed once so it can be evaluated many times cheaply.
+    Use compile_equation to get one of these, as that reuses equations that have already been compiled.
+    If the text is not a valid equation then error is set, and this should not be rendered.
+    """
+
+    source: tuple[str, str]
+    """
+    The (lhs, rhs) that this was compiled from.
+    """
+    error: str | None
+    """
+    A short description of why this equation is not valid, or None if it is valid.
+    """
+    lhs: ast.expr | None  # The validated trees of each side, None if this is not valid
+    rhs: ast.expr | None
+    evaluate: typing.Callable[[float, float], bool]
+    """
+    Evaluate if lhs>=rhs at a given (x,y). This never raises, points where the maths isn't defined are False.
+    """
+    solved_for: str | None
+    """
+    "y" if this is of the form y=f(x), or "x" if it is of the form x=f(y), so it can be drawn by evaluating f once per
+    column (or row) with evaluate_solved. Otherwise None.
+    """
+    _grid_function: typing.Callable | None
+    _solved_function: typing.Callable | None  # f, as functions of (x, y) that only use the other variable
+    _solved_grid_function: typing.Callable | None
+
+    def __init__(self, source: tuple[str, str]):
+        self.source = source
+        self.error = None
+        self.lhs = None
+        self.rhs = None
+        self._grid_function = None
+        self.solved_for = None
+        self._solved_function = None
+        self._solved_grid_function = None
+        self.evaluate = lambda x, y: False
+
+        try:
+            self.lhs = parse_expression(source[0])
+            self.rhs = parse_expression(source[1])
+        except EquationError as e:
+            self.error = str(e)
+            return
+
+        try:
+            comparison = ast.Compare(left=self.lhs, ops=[ast.GtE()], comparators=[self.rhs])
+            self.evaluate = build_function(comparison, scalar_namespace(), True)
+            if numpy is not None:
+                self._grid_function = build_function(comparison, grid_namespace(), False)
+
+            for variable in ("y", "x"):  # Prefer y=f(x) for equations like y=x that are both
+                for side, other in ((self.lhs, self.rhs), (self.rhs, self.lhs)):
+                    if self.solved_for is None and isinstance(side, ast.Name) and side.id == variable and \
+                            variable not in {node.id for node in ast.walk(other) if isinstance(node, ast.Name)}:
+                        self.solved_for = variable
+                        self._solved_function = build_function(other, scalar_namespace(), True, math.nan)
+                        if numpy is not None:
+                            self._solved_grid_function = build_function(other, grid_namespace(), False)
+        except (RecursionError, MemoryError):  # Nested too deeply for the compiler
+            self.error = "Too long"
+            self.lhs = self.rhs = None
+            self._grid_function = self._solved_function = self._solved_grid_function = None
+            self.solved_for = None
+            self.evaluate = lambda x, y: False
+
+    @property
+    def valid(self) -> bool:
+        return self.error is None
+
+    def evaluate_grid(self, xs, ys):
+        """
+        Evaluate if lhs>=rhs for every point of the given NumPy arrays of x and y coordinates at once.
+        Returns a bool array of the same shape, or None if NumPy is unavailable or this equation can't be vectorized.
+        """
+        if self._grid_function is None:
+            return None
+        try:
+            with numpy.errstate(all="ignore"):  # Don't warn about invalid points, nan compares as False
+                result = numpy.asarray(self._grid_function(xs, ys))
+        except _CAUGHT_ERRORS:
+            return None
+        if result.dtype != bool:
+            return None
+        return numpy.broadcast_to(result, numpy.broadcast(xs, ys).shape)  # Equations that don't use x or y give a single value
+
+    def evaluate_solved(self, values: list[float]) -> list[float]:
+        """
+        For an equation that is solved_for a variable, evaluate that variable at each of the given values of the other
+        one. Points where the maths isn't defined are nan.
+        """
+        # f only uses the other variable, so the values can be passed as both x and y
+        if self._solved_grid_function is not None:
+            array = numpy.asarray(values, dtype=float)
+            try:
+                with numpy.errstate(all="ignore"):
+                    result = numpy.asarray(self._solved_grid_function(array, array))
+            except _CAUGHT_ERRORS:
+                result = None
+            if result is not None and result.dtype.kind in "biuf":  # Otherwise fall back to evaluating one at a time
+                return numpy.broadcast_to(result, array.shape).astype(float).tolist()
+
+        results = []
+        for value in values:
+            try:
+                results.append(float(self._solved_function(value, value)))
+            except (TypeError, OverflowError):  # Complex numbers (e.g. from (-1)**0.5), or ints too big for a float
+                results.append(math.nan)
+        return results
+
+
+class EquationGroup:
+    """
+    Several valid equations compiled into one function for NumPy arrays, where subexpressions that appear more than
+    once (in one equation or across several) are only evaluated once per point.
+    Use compile_equation_group to get one of these.
+    """
+
+    equations: list[CompiledEquation]
+    _grid_function: typing.Callable | None
+    """
+    Returns a tuple of lhs>=rhs for each equation, None if NumPy is unavailable.
+    """
+
+    def __init__(self, equations: list[CompiledEquation]):
+        self.equations = equations
+        self._grid_function = None
+        if numpy is not None:
+            comparisons = [ast.Compare(left=equation.lhs, ops=[ast.GtE()], comparators=[equation.rhs]) for equation in equations]
+            statements, results = share_subexpressions(comparisons)
+            self._grid_function = build_function(ast.Tuple(results, ast.Load()), grid_namespace(), False, statements=statements)
+
+    def evaluate_grid(self, xs, ys) -> list:
+        """
+        The same as calling evaluate_grid on each equation, but sharing the work between them.
+        """
+        if self._grid_function is None:
+            return [None] * len(self.equations)
+        try:
+            with numpy.errstate(all="ignore"):
+                results = [numpy.asarray(result) for result in self._grid_function(xs, ys)]
+        except _CAUGHT_ERRORS:  # One of them can't be vectorized, let them find out which on their own
+            return [equation.evaluate_grid(xs, ys) for equation in self.equations]
+        shape = numpy.broadcast(xs, ys).shape
+        return [numpy.broadcast_to(result, shape) if result.dtype == bool else None for result in results]
+
+
+@functools.lru_cache(maxsize=256)
+def compile_equation(source: tuple[str, str]) -> CompiledEquation:
+    """
+    Compile the given (lhs, rhs).
+    This is cached on the source text, so an equation is only compiled again once its text has been changed.
+    Check CompiledEquation.valid before using the result.
+    """
+    return CompiledEquation(source)
+
+
+@functools.lru_cache(maxsize=64)
+def compile_equation_group(sources: tuple[tuple[str, str], ...]) -> EquationGroup:
+    """
+    Compile the given valid equations together, this is cached on their source text like compile_equation.
+    """
+    return EquationGroup([compile_equation(source) for source in sources])
@@ -1,70 +1,785 @@
+import collections
+import concurrent.futures
+import math
+import threading
 import typing
 
+import profiling
+from equation import CompiledEquation, compile_equation, compile_equation_group, numpy
+from interval import compile_interval_function, may_cross
+from layer import Layer, pack_rows, merge_layers, CELL, RESOLUTIONS
 from window import Window, BLACK, WHITE
 
+UNIFORM = "uniform"
+"""
+Render mode that evaluates the equation at every cell.
+"""
+ADAPTIVE = "adaptive"
+"""
+Render mode that evaluates blocks of cells at their corners, only going down to every cell where the corners disagree.
+This is much faster for most curves, but can miss parts of the curve that fit inside a block.
+"""
+INTERVAL = "interval"
+"""
+Render mode that uses interval arithmetic to skip rectangles of cells that the curve certainly doesn't cross, and draws
+every cell that it might cross. This can't miss parts of the curve that are thinner than a cell, unlike sampling.
+"""
+CONTOUR = "contour"
+"""
+Render mode that only evaluates a grid of points CONTOUR_GRID_SIZE cells apart, finds where the curve crosses between
+them by bisection, and draws lines joining the crossings. This needs far fewer evaluations than UNIFORM and draws a thin
+line where the curve actually is, but like ADAPTIVE it can miss parts of the curve that fit between the grid points.
+"""
+RENDER_MODES = (UNIFORM, ADAPTIVE, INTERVAL, CONTOUR)
 
-def evaluate(equation: tuple[str, str], x: float, y: float) -> bool:
+CONTOUR_GRID_SIZE = 4
+"""
+How many cells apart the grid points of the CONTOUR mode are.
+"""
+CONTOUR_BISECTIONS = 4
+"""
+How many times the CONTOUR mode halves the part of a grid edge that the curve crosses, each one halves how far the
+crossing can be from where it is drawn.
+"""
+
+TILE_WIDTH = 64
+"""
+The width of the tiles in a TileCache, in samples.
+"""
+TILE_HEIGHT = 32
+"""
+The height of the tiles in a TileCache, in samples.
+"""
+
+PROGRESSIVE_FACTORS = (4, 2, 1)
+"""
+How many samples apart each pass of render_equations_progressively samples at, coarsest first.
+"""
+PROGRESSIVE_MAX_MISSING = 0.5
+"""
+The coarse passes of render_equations_progressively are only done when more than this fraction of the tiles the full
+pass needs are missing. They sample the whole canvas, so e.g. after a small pan they cost more than the few new tiles.
+"""
+
+
+class RenderCache:
     """
-    Evaluate if lhs>=rhs at a given (x,y)
+    Stores rendered equations so they don't have to be rendered again if nothing has changed.
+    Keys are (equation source, view bounds, canvas size), when full the least recently used render is dropped.
     """
-    try:
-        return eval(equation[0]) >= eval(equation[1])
-    except:
-        return False  # TODO: Do this better
 
-def get_if_in_array(x, y, array):
+    _renders: collections.OrderedDict
+    _max_size: int
+    """
+    The maximum number of renders to keep.
+    """
+    _lock: threading.Lock
+    """
+    Renders that have been overtaken may still be finishing on other threads, so they can use the cache at once.
+    """
+
+    def __init__(self, max_size: int = 64):
+        self._renders = collections.OrderedDict()
+        self._max_size = max_size
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the render stored for the given key, or None if there isn't one.
+        """
+        with self._lock:
+            if key not in self._renders:
+                return None
+            self._renders.move_to_end(key)
+            return self._renders[key]
+
+    def put(self, key, render):
+        with self._lock:
+            self._renders[key] = render
+            self._renders.move_to_end(key)
+            while len(self._renders) > self._max_size:
+                self._renders.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._renders.clear()
+
+    def items(self) -> list[tuple[typing.Any, typing.Any]]:
+        """
+        Returns every (key, render), from the most recently used.
+        """
+        with self._lock:
+            return list(reversed(self._renders.items()))
+
+
+def sample_equation(equation: CompiledEquation, x: float, y: float, step_x: float, step_y: float, width: int, height: int):
+    """
+    Figure out what is 'above' and 'below' the curve for a grid of width * height points.
+    The first point is (x, y), and each next point is step_x to the right or step_y down.
+
+    The returned array will be above_below_map[y][x], this is a NumPy bool array if the equation could be vectorized,
+    otherwise it is a list of lists.
+    """
+    profiling.add_evaluations(width * height)
+    if numpy is not None:  # Use the vectorized evaluation if we can, falling back if this equation can't be
+        xs = x + step_x * numpy.arange(width)
+        ys = y - step_y * numpy.arange(height)
+        above_below_map = equation.evaluate_grid(*numpy.meshgrid(xs, ys))
+        if above_below_map is not None:
+            return above_below_map
+
+    return [[equation.evaluate(x + step_x * i, y - step_y * j) for i in range(width)] for j in range(height)]
+
+def sample_equations(equations: list[CompiledEquation], x: float, y: float, step_x: float, step_y: float, width: int, height: int) -> list:
+    """
+    The same as calling sample_equation for each equation, but when they can be vectorized subexpressions that are
+    used more than once (e.g. x**2 in several equations) are only evaluated once per point.
+    """
+    if numpy is not None:
+        xs = x + step_x * numpy.arange(width)
+        ys = y - step_y * numpy.arange(height)
+        above_below_maps = compile_equation_group(tuple(equation.source for equation in equations)).evaluate_grid(*numpy.meshgrid(xs, ys))
+        profiling.add_evaluations(width * height * sum(above_below_map is not None for above_below_map in above_below_maps))
+        return [above_below_map if above_below_map is not None else sample_equation(equation, x, y, step_x, step_y, width, height)
+                for equation, above_below_map in zip(equations, above_below_maps)]
+    return [sample_equation(equation, x, y, step_x, step_y, width, height) for equation in equations]
+
+def sample_equation_adaptive(equation: CompiledEquation, x: float, y: float, step_x: float, step_y: float, width: int, height: int, block_size: int = 8):
+    """
+    The same as sample_equation, but this starts by evaluating the corners of block_size * block_size blocks.
+    Blocks whose corners all agree are filled with that value, the rest are split into four and checked again until
+    every point of the block has been evaluated.
+    Anything smaller than a block that doesn't cross a corner of it may be missed, so smaller blocks are safer but slower.
+
+    The returned array is always a list of lists.
+    """
+    if width < 2 or height < 2:
+        return sample_equation(equation, x, y, step_x, step_y, width, height)
+
+    above_below_map = [[False] * width for _ in range(height)]
+    evaluated = [[False] * width for _ in range(height)]  # So guessed values are never taken as real ones
+
+    evaluation_count = 0
+
+    def sample(i, j):
+        nonlocal evaluation_count
+        if not evaluated[j][i]:
+            above_below_map[j][i] = equation.evaluate(x + step_x * i, y - step_y * j)
+            evaluated[j][i] = True
+            evaluation_count += 1
+        return above_below_map[j][i]
+
+    def fill(left, top, right, bottom):  # The corners are inclusive
+        corners = {sample(left, top), sample(right, top), sample(left, bottom), sample(right, bottom)}
+        if len(corners) == 1:  # Assume the whole block is the same as its corners
+            value = corners.pop()
+            for j in range(top, bottom + 1):
+                for i in range(left, right + 1):
+                    if not evaluated[j][i]:
+                        above_below_map[j][i] = value
+        elif right - left > 1 or bottom - top > 1:  # Otherwise split it up, unless every point is already a corner
+            xs = (left, right) if right - left <= 1 else (left, (left + right) // 2, right)
+            ys = (top, bottom) if bottom - top <= 1 else (top, (top + bottom) // 2, bottom)
+            for sub_top, sub_bottom in zip(ys, ys[1:]):
+                for sub_left, sub_right in zip(xs, xs[1:]):
+                    fill(sub_left, sub_top, sub_right, sub_bottom)
+
+    for top in range(0, height - 1, block_size):
+        for left in range(0, width - 1, block_size):
+            fill(left, top, min(left + block_size, width - 1), min(top + block_size, height - 1))
+
+    profiling.add_evaluations(evaluation_count)
+    return above_below_map
+
+def trace_line(above_below_map) -> Layer:
     """
-    If (x, y) is a valid coordinate then return array[x][y], else return True.
+    Given an above_below_map from sample_equation, return a layer of where the line should be drawn.
+    The map should have a pixel of padding on each edge, which is cropped off the result.
     """
-    if 0 < x < len(array):
-        if 0 < y < len(array[x]):
-            return array[x][y]
-    return True
+    rows = pack_rows(above_below_map)
+    width = (len(above_below_map[0]) if len(above_below_map) else 2) - 2
+    crop = (1 << width) - 1
+
+    # Now where 'above' switches to 'below' is where we should draw the line. If we have [False, True, True], we will get [False, True, False]
+    # Shifting a row by one lines each cell up with its left or right neighbour, so each row is done in a few operations
+    result = []
+    for y in range(1, len(rows) - 1):
+        row = rows[y]
+        surrounded = (row << 1) & (row >> 1) & rows[y - 1] & rows[y + 1]  # Cells whose neighbours are all true
+        result.append(((row & ~surrounded) >> 1) & crop)  # If we are true and any adjacent is not true, without the padding
+    return Layer(width, len(result), result)
 
-def render_equation(equation: tuple[str, str], view_left: float, view_right: float, view_top: float, view_bottom: float, canvas_width: int, canvas_height: int):
+def get_steps(view_left: float, view_right: float, view_top: float, view_bottom: float, canvas_width: int, canvas_height: int) -> tuple[float, float]:
+    """
+    Returns the (x, y) distance in the graph world between the centers of two adjacent cells of the canvas.
     """
-    Render the given equation to a string of the dimensions (canvas_width,canvas_height), with lines separated by newlines.
-    An empty space will be returned as " ".
+    return (view_right - view_left) / (canvas_width - 1), (view_top - view_bottom) / (canvas_height - 1)
+
+def render_equation(equation: CompiledEquation, view_left: float, view_right: float, view_top: float, view_bottom: float, canvas_width: int, canvas_height: int, mode: str = UNIFORM, block_size: int = 8) -> Layer:
+    """
+    Render the given equation to a layer of the dimensions (canvas_width,canvas_height).
     The given bounding box will be rendered.
+    The mode is one of RENDER_MODES, block_size is used by ADAPTIVE.
+    Equations that are solved for x or y are drawn with render_solved_band whatever the mode.
 
     This assumes that positive x is left, and positive y is up.
+    """
+    step_x, step_y = get_steps(view_left, view_right, view_top, view_bottom, canvas_width, canvas_height)
+    return render_equation_band(equation, view_left, view_top, step_x, step_y, canvas_width, 0, canvas_height, mode, block_size)
 
-    The returned array will be array[y][x]
+def render_equation_band(equation: CompiledEquation, view_left: float, view_top: float, step_x: float, step_y: float, canvas_width: int, row_start: int, row_end: int, mode: str = UNIFORM, block_size: int = 8) -> Layer:
+    """
+    Render rows row_start up to row_end of what render_equation would give for a canvas with its top left cell at
+    (view_left, view_top), this allows a canvas to be split into bands which are rendered separately.
     """
-    # This will first render with width + 2, height + 2 to ensure that the edges are drawn correctly.
+    if equation.solved_for is not None:
+        return render_solved_band(equation, view_left, view_top, step_x, step_y, canvas_width, row_start, row_end)
+    if mode == INTERVAL:
+        return render_interval_band(equation, view_left, view_top, step_x, step_y, canvas_width, row_start, row_end)
+    if mode == CONTOUR:
+        return render_contour_band(equation, view_left, view_top, step_x, step_y, canvas_width, row_start, row_end)
 
+    # We render with 1 pixel extra on each edge which is cropped off later, to ensure that the edges are drawn correctly.
+    x = view_left - step_x
+    y = view_top - step_y * (row_start - 1)
+    if mode == ADAPTIVE:
+        above_below_map = sample_equation_adaptive(equation, x, y, step_x, step_y, canvas_width + 2, row_end - row_start + 2, block_size)
+    else:
+        above_below_map = sample_equation(equation, x, y, step_x, step_y, canvas_width + 2, row_end - row_start + 2)
+    return trace_line(above_below_map)
 
-    # First figure out what is 'above' and 'below' the curve. We render with 1 pixel extra on each edge which is cropped off later
-    view_width = view_right - view_left
-    view_height = view_top - view_bottom
-    step_x = view_width / (canvas_width - 1)
-    step_y = view_height / (canvas_height - 1)
-    above_below_map = [[evaluate(equation, view_left + step_x * (x - 1), view_top - step_y * (y - 1)) for y in range(canvas_width + 2)] for x in
-                       range(canvas_width + 2)]
+def get_solved_spans(positions: list[float]) -> list[tuple[int, int] | None]:
+    """
+    Given where a curve is at a run of points, as a fractional cell index along the other axis, with a point of padding
+    at each end, returns the (first, last) cell that should be drawn for each point between the padding.
+    Each span reaches halfway to the neighbouring points, so the curve is joined up however steep it is.
+    Points where the curve isn't defined are None, and aren't joined to.
+    """
+    spans = []
+    for n in range(1, len(positions) - 1):
+        position = positions[n]
+        if not math.isfinite(position):
+            spans.append(None)
+            continue
+        low = high = position
+        for neighbour in (positions[n - 1], positions[n + 1]):
+            if math.isfinite(neighbour):
+                middle = (position + neighbour) / 2
+                low, high = min(low, middle), max(high, middle)
+        spans.append((round(low), round(high)))
+    return spans
 
-    # Now where 'above' switches to 'below' is where we should draw the line. If we have [False, True, True], we will get [False, True, False]
-    result = [[
-        (above_below_map[x][y] and not (  # If we are true and any adjacent is not true
-                get_if_in_array(x - 1, y, above_below_map) and
-                get_if_in_array(x, y - 1, above_below_map) and
-                get_if_in_array(x, y + 1, above_below_map) and
-                get_if_in_array(x + 1, y, above_below_map)
-        )) for x in range(canvas_width + 2)] for y in range(canvas_height + 2)]  # Still use extra padding
+def render_solved_band(equation: CompiledEquation, view_left: float, view_top: float, step_x: float, step_y: float, canvas_width: int, row_start: int, row_end: int) -> Layer:
+    """
+    The same as render_equation_band, for an equation that is solved_for y or x.
+    Rather than sampling every cell, this evaluates the equation once per column (or row) and joins each point to the
+    next, so it only does O(width) work and steep parts of the curve stay connected.
+    """
+    rows = [0] * (row_end - row_start)
+    if equation.solved_for == "y":
+        xs = [view_left + step_x * column for column in range(-1, canvas_width + 1)]
+        ys = equation.evaluate_solved(xs)
+        profiling.add_evaluations(len(xs))
+        for column, span in enumerate(get_solved_spans([(view_top - y) / step_y for y in ys])):
+            if span is not None:
+                for row in range(max(span[0], row_start), min(span[1] + 1, row_end)):
+                    rows[row - row_start] |= 1 << column
+    else:
+        ys = [view_top - step_y * row for row in range(row_start - 1, row_end + 1)]
+        xs = equation.evaluate_solved(ys)
+        profiling.add_evaluations(len(ys))
+        for row, span in enumerate(get_solved_spans([(x - view_left) / step_x for x in xs])):
+            if span is not None:
+                first, last = max(span[0], 0), min(span[1], canvas_width - 1)
+                if first <= last:
+                    rows[row] = ((1 << (last - first + 1)) - 1) << first
+    return Layer(canvas_width, row_end - row_start, rows)
+
+def render_interval_band(equation: CompiledEquation, view_left: float, view_top: float, step_x: float, step_y: float, canvas_width: int, row_start: int, row_end: int, refine_depth: int = 2) -> Layer:
+    """
+    The same as render_equation_band, but this draws every cell that the curve may cross, as found by interval arithmetic.
+    Rectangles of cells where lhs is certainly never equal to rhs are skipped, the rest are split into four and checked
+    again until they are single cells. The bounds are loose for big rectangles, so those cells are then split
+    refine_depth more times, and only drawn if some part of them still may be crossed.
+    Places where the equation stops being defined are not drawn, as the curve doesn't reach them.
+    """
+    interval_function = compile_interval_function(equation)
+    rows = [0] * (row_end - row_start)
+    evaluation_count = 0
+
+    def crossed(left, top, right, bottom):  # In cells, which can be fractions of one, where cell (0, 0) is centred on (view_left, view_top)
+        nonlocal evaluation_count
+        evaluation_count += 1
+        return may_cross(interval_function, (view_left + (left - 0.5) * step_x, view_left + (right - 0.5) * step_x),
+                         (view_top - (bottom - 0.5) * step_y, view_top - (top - 0.5) * step_y))
+
+    def refine(left, top, size, depth):
+        if not crossed(left, top, left + size, top + size):
+            return False
+        half = size / 2
+        return depth == 0 or any(refine(left + dx, top + dy, half, depth - 1) for dy in (0, half) for dx in (0, half))
 
-    # Crop off the padding on the edges we added and return
-    return [
-        list(("#" if char else " ") for char in result[y + 1][1:canvas_width + 1]) for y in range(canvas_height)
-    ]
+    def fill(left, top, right, bottom):  # The right and bottom are exclusive
+        if not crossed(left, top, right, bottom):
+            return
+        if right - left == 1 and bottom - top == 1:
+            if refine_depth == 0 or any(refine(left + dx, top + dy, 0.5, refine_depth - 1) for dy in (0, 0.5) for dx in (0, 0.5)):
+                rows[top - row_start] |= 1 << left
+            return
+        xs = (left, right) if right - left == 1 else (left, (left + right) // 2, right)
+        ys = (top, bottom) if bottom - top == 1 else (top, (top + bottom) // 2, bottom)
+        for sub_top, sub_bottom in zip(ys, ys[1:]):
+            for sub_left, sub_right in zip(xs, xs[1:]):
+                fill(sub_left, sub_top, sub_right, sub_bottom)
 
-def render_equations(equations: list[tuple[str, str]], window: "Window", view_left: float, view_right: float, view_top: float, view_bottom: float, canvas_x: int, canvas_y: int, canvas_width: int, canvas_height: int):
+    if canvas_width > 0 and row_end > row_start:
+        fill(0, row_start, canvas_width, row_end)
+    profiling.add_evaluations(evaluation_count)
+    return Layer(canvas_width, row_end - row_start, rows)
+
+def trace_contours(equation: CompiledEquation, view_left: float, view_top: float, step_x: float, step_y: float, left: int, top: int, right: int, bottom: int, grid_size: int = CONTOUR_GRID_SIZE, bisections: int = CONTOUR_BISECTIONS) -> list[list[tuple[float, float]]]:
     """
-    View parameters are floats, they are the bounding box of the graph world we want to see.
-    Canvas parameters are how it should be drawn onto the window.
+    Find the curve over the cells from (left, top) to (right, bottom) inclusive with marching squares, returning it as
+    polylines of (column, row) points, in cells which can be fractions of one, where cell (0, 0) is centred on
+    (view_left, view_top).
+    The equation is evaluated on a grid of points grid_size cells apart, lined up with the world's origin rather than the
+    view, so the same points are used however the plane is split into views, bands and tiles. Where the two ends of a
+    grid edge disagree the crossing is found by bisecting the edge, and the crossings around each square are joined up,
+    with the middle of the square deciding which way when all four edges are crossed.
+    Points are evaluated a batch at a time, so they are vectorized when they can be.
+    """
+    origin_column, origin_row = round(view_left / step_x), -round(view_top / step_y)  # Cell (0, 0) counted from the origin, as tiles are
+    # A point past each edge, so curves by the edge are found
+    first_column, first_row = (origin_column + left - 1) // grid_size, (origin_row + top - 1) // grid_size
+    columns = (origin_column + right) // grid_size + 2 - first_column
+    rows = (origin_row + bottom) // grid_size + 2 - first_row
+    first_x, first_y = first_column * grid_size - origin_column, first_row * grid_size - origin_row
+    signs = sample_equation(equation, view_left + first_x * step_x, view_top - first_y * step_y,
+                            grid_size * step_x, grid_size * step_y, columns, rows)
+    packed = pack_rows(signs)
+    if numpy is not None and isinstance(signs, numpy.ndarray):
+        signs = signs.tolist()  # Faster to index one at a time
+
+    def evaluate(points: list[tuple[float, float]]) -> list[bool]:
+        profiling.add_evaluations(len(points))
+        if numpy is not None and points:
+            array = numpy.array(points)
+            values = equation.evaluate_grid(view_left + array[:, 0] * step_x, view_top - array[:, 1] * step_y)
+            if values is not None:
+                return values.tolist()
+        return [equation.evaluate(view_left + column * step_x, view_top - row * step_y) for column, row in points]
+
+    def get_point(i, j):
+        return first_x + i * grid_size, first_y + j * grid_size
+
+    # The crossed edges of each square, clockwise from the top, as the (i, j) of their ends with the lower end first, so
+    # the two squares either side of an edge agree on it
+    squares = {}
+    for j in range(rows - 1):
+        top_row, bottom_row = packed[j], packed[j + 1]
+        # Bit i is set if square i's top, bottom or left edge is crossed, if none are then neither is its right edge
+        mixed = (top_row ^ (top_row >> 1) | bottom_row ^ (bottom_row >> 1) | top_row ^ bottom_row) & ((1 << (columns - 1)) - 1)
+        while mixed:
+            i = (mixed & -mixed).bit_length() - 1
+            mixed &= mixed - 1
+            corners = ((i, j), (i + 1, j), (i + 1, j + 1), (i, j + 1))
+            squares[i, j] = [(min(a, b), max(a, b)) for a, b in zip(corners, corners[1:] + corners[:1])
+                             if signs[a[1]][a[0]] != signs[b[1]][b[0]]]
 
-    This will render all the equations to the given window.
+    # Where opposite corners agree, the middle says which pair of corners the curve cuts off
+    saddles = [(i, j) for (i, j), edges in squares.items() if len(edges) == 4]
+    middles = evaluate([(column + grid_size / 2, row + grid_size / 2) for column, row in (get_point(i, j) for i, j in saddles)])
+    for (i, j), middle in zip(saddles, middles):
+        if middle != signs[j][i]:
+            squares[i, j] = squares[i, j][3:] + squares[i, j][:3]  # The top left and bottom right, rather than the top right and bottom left
+
+    neighbours = collections.defaultdict(list)  # The edges joined to each crossed edge, at most one through each square
+    for edges in squares.values():
+        for a, b in zip(edges[::2], edges[1::2]):
+            neighbours[a].append(b)
+            neighbours[b].append(a)
+
+    # Bisect every crossed edge at once from its lower end, keeping the half whose ends still disagree
+    crossed = list(neighbours)
+    starts = [get_point(*a) for a, b in crossed]
+    ends = [get_point(*b) for a, b in crossed]
+    for _ in range(bisections):
+        middles = [((start[0] + end[0]) / 2, (start[1] + end[1]) / 2) for start, end in zip(starts, ends)]
+        for n, value in enumerate(evaluate(middles)):
+            if value == signs[crossed[n][0][1]][crossed[n][0][0]]:
+                starts[n] = middles[n]
+            else:
+                ends[n] = middles[n]
+    crossings = {edge: ((start[0] + end[0]) / 2, (start[1] + end[1]) / 2) for edge, start, end in zip(crossed, starts, ends)}
+
+    # Walk from the ends of open curves first, then whatever is left are closed loops
+    polylines = []
+    visited = set()
+    for start in sorted(crossed, key=lambda edge: len(neighbours[edge])):
+        if start in visited:
+            continue
+        polyline = []
+        edge = start
+        while edge is not None:
+            visited.add(edge)
+            polyline.append(crossings[edge])
+            edge = next((neighbour for neighbour in neighbours[edge] if neighbour not in visited), None)
+        if len(neighbours[start]) == 2 and len(polyline) > 2:  # Close the loop
+            polyline.append(polyline[0])
+        polylines.append(polyline)
+    return polylines
+
+def render_contour_band(equation: CompiledEquation, view_left: float, view_top: float, step_x: float, step_y: float, canvas_width: int, row_start: int, row_end: int) -> Layer:
+    """
+    The same as render_equation_band, but this draws the polylines from trace_contours, a cell wide.
+    """
+    rows = [0] * (row_end - row_start)
+    if canvas_width <= 0 or row_end <= row_start:
+        return Layer(canvas_width, row_end - row_start, rows)
+
+    for polyline in trace_contours(equation, view_left, view_top, step_x, step_y, 0, row_start, canvas_width - 1, row_end - 1):
+        for (start_x, start_y), (end_x, end_y) in zip(polyline, polyline[1:]):
+            count = max(1, math.ceil(max(abs(end_x - start_x), abs(end_y - start_y))))  # At most a cell apart, so there are no gaps
+            for n in range(count + 1):
+                column = math.floor(start_x + (end_x - start_x) * n / count + 0.5)
+                row = math.floor(start_y + (end_y - start_y) * n / count + 0.5)
+                if 0 <= column < canvas_width and row_start <= row < row_end:
+                    rows[row - row_start] |= 1 << column
+    return Layer(canvas_width, row_end - row_start, rows)
+
+def _render_band_in_worker(source: tuple[str, str], *args) -> tuple[Layer, int]:
+    """
+    Runs render_equation_band in a worker process, the equation is sent as its source as compiled ones can't be pickled.
+    Returns the layer and how many evaluations it took, as workers can't record them on the main process's profiler.
+    """
+    profiler = profiling.Profiler()
+    previous = profiling.get_active()  # Forked workers have a copy of the main process's, which nothing reads
+    profiling.set_active(profiler)
+    try:
+        layer = render_equation_band(compile_equation(source), *args)
+    finally:
+        profiling.set_active(previous)
+    return layer, profiler.get_evaluations()
+
+class TileCache:
+    """
+    Renders of equations split into TILE_WIDTH * TILE_HEIGHT tiles, so that views made of tiles that have been seen
+    before are put together from them instead of rendering again.
+    Tiles sit on the lattice of samples at a given step, where sample (0, 0) is at the origin of the graph world, so
+    any view whose top left sample is on that lattice can use them. Each zoom level has its own step, and so its own
+    tiles. When full the least recently used tiles are dropped.
+    """
+
+    _tiles: RenderCache
+    """
+    The layer of each tile, keyed by (equation source, mode, block_size, step_x, step_y, tile column, tile row).
+    """
+    _stored: typing.Any
+    """
+    Tiles from somewhere else (e.g. a saved session) to use when they aren't in _tiles, with get(key) and keys().
+    """
+    _max_tiles: int
+
+    def __init__(self, max_tiles: int = 4096, stored=None):
+        """
+        Creates a tile cache keeping up to max_tiles tiles in memory, that also takes tiles from stored if given.
+        """
+        self._tiles = RenderCache(max_tiles)
+        self._stored = stored
+        self._max_tiles = max_tiles
+
+    def _get(self, key) -> Layer | None:
+        tile = self._tiles.get(key)
+        if tile is None and self._stored is not None:
+            tile = self._stored.get(key)
+            if tile is not None:
+                self._tiles.put(key, tile)
+        return tile
+
+    def get_tiles(self) -> typing.Iterator[tuple[tuple, Layer]]:
+        """
+        Iterate over up to max_tiles (key, tile), the most recently used first and then those from stored.
+        Tiles from stored are only loaded as they are reached.
+        """
+        keys = set()
+        for key, tile in self._tiles.items():
+            keys.add(key)
+            yield key, tile
+        if self._stored is not None:
+            for key in self._stored.keys():
+                if len(keys) >= self._max_tiles:
+                    return
+                if key not in keys:
+                    keys.add(key)
+                    yield key, self._stored.get(key)
+
+    def is_aligned(self, view_left: float, view_top: float, step_x: float, step_y: float) -> bool:
+        """
+        True if a view's top left sample is on the lattice of tiles for its step, so it can be rendered from them.
+        """
+        return abs(view_left / step_x - round(view_left / step_x)) < 1e-6 and abs(view_top / step_y - round(view_top / step_y)) < 1e-6
+
+    def _get_tile_range(self, view_left: float, view_top: float, step_x: float, step_y: float, canvas_width: int, canvas_height: int) -> tuple[int, int, range, range]:
+        """
+        The column and row of an aligned view's top left sample, counting down from the origin, and the columns and rows
+        of the tiles it covers.
+        """
+        left, top = round(view_left / step_x), -round(view_top / step_y)
+        tile_xs = range(left // TILE_WIDTH, (left + canvas_width - 1) // TILE_WIDTH + 1)
+        tile_ys = range(top // TILE_HEIGHT, (top + canvas_height - 1) // TILE_HEIGHT + 1)
+        return left, top, tile_xs, tile_ys
+
+    def get_missing_fraction(self, equations: list[CompiledEquation], view_left: float, view_top: float, step_x: float, step_y: float, canvas_width: int, canvas_height: int, mode: str = UNIFORM, block_size: int = 8) -> float:
+        """
+        The fraction of the tiles the view needs for the equations that render would have to render, from 0 if they are
+        all stored to 1 if none are. This is 1 if the view isn't aligned, as then it can't be rendered from tiles.
+        """
+        if not self.is_aligned(view_left, view_top, step_x, step_y):
+            return 1
+        _, _, tile_xs, tile_ys = self._get_tile_range(view_left, view_top, step_x, step_y, canvas_width, canvas_height)
+        keys = [(equation.source, mode, block_size, step_x, step_y, tile_x, tile_y) for tile_y in tile_ys for tile_x in tile_xs for equation in equations]
+        return sum(self._get(key) is None for key in keys) / len(keys) if keys else 0
+
+    def _render_tiles(self, equations: list[CompiledEquation], tile_x: int, tile_y: int, step_x: float, step_y: float, mode: str, block_size: int) -> list[Layer]:
+        """
+        Render the tile at the given column and row for each of the equations.
+        """
+        tile_left, tile_top = tile_x * TILE_WIDTH * step_x, -tile_y * TILE_HEIGHT * step_y
+        shared = [equation for equation in equations if mode == UNIFORM and equation.solved_for is None]
+        layers = {}
+        if shared:  # Sample these together so they share work, with the padding trace_line expects
+            with profiling.section("equations " + ", ".join("=".join(equation.source) for equation in shared)):
+                above_below_maps = sample_equations(shared, tile_left - step_x, tile_top + step_y, step_x, step_y, TILE_WIDTH + 2, TILE_HEIGHT + 2)
+                for equation, above_below_map in zip(shared, above_below_maps):
+                    layers[equation] = trace_line(above_below_map)
+        for equation in equations:
+            if equation not in layers:
+                with profiling.section("equation " + "=".join(equation.source)):
+                    layers[equation] = render_equation_band(equation, tile_left, tile_top, step_x, step_y, TILE_WIDTH, 0, TILE_HEIGHT, mode, block_size)
+        return [layers[equation] for equation in equations]
+
+    def render(self, equations: list[CompiledEquation], view_left: float, view_top: float, step_x: float, step_y: float, canvas_width: int, canvas_height: int, mode: str = UNIFORM, block_size: int = 8, executor: concurrent.futures.Executor | None = None, is_cancelled: typing.Callable[[], bool] | None = None) -> list[Layer] | None:
+        """
+        Returns the same layers that render_equation would give for each equation, for a view that is_aligned.
+        Tiles that aren't stored yet are rendered and stored, in the executor if one is given.
+        is_cancelled is checked between tiles, once it returns True this gives up and returns None, keeping the tiles
+        that were finished.
+        """
+        is_cancelled = is_cancelled or (lambda: False)
+        left, top, tile_xs, tile_ys = self._get_tile_range(view_left, view_top, step_x, step_y, canvas_width, canvas_height)
+
+        def get_key(equation, tile_x, tile_y):
+            return equation.source, mode, block_size, step_x, step_y, tile_x, tile_y
+
+        tiles = {}  # The layer of each key that is needed
+        missing = {}  # The equations whose tile is missing at each (tile column, tile row)
+        for tile_y in tile_ys:
+            for tile_x in tile_xs:
+                for equation in equations:
+                    tiles[get_key(equation, tile_x, tile_y)] = tile = self._get(get_key(equation, tile_x, tile_y))
+                    if tile is None:
+                        missing.setdefault((tile_x, tile_y), []).append(equation)
+
+        if executor is not None:
+            futures = {get_key(equation, tile_x, tile_y): executor.submit(
+                _render_band_in_worker, equation.source, tile_x * TILE_WIDTH * step_x, -tile_y * TILE_HEIGHT * step_y,
+                step_x, step_y, TILE_WIDTH, 0, TILE_HEIGHT, mode, block_size
+            ) for (tile_x, tile_y), tile_equations in missing.items() for equation in tile_equations}
+            for equation in equations:
+                with profiling.section("equation " + "=".join(equation.source)):  # Only the time spent waiting for it, as it renders in parallel
+                    for key, future in futures.items():
+                        if key[0] != equation.source:
+                            continue
+                        if is_cancelled():
+                            for future in futures.values():
+                                future.cancel()
+                            return None
+                        tiles[key], evaluations = future.result()
+                        profiling.add_evaluations(evaluations)
+                        self._tiles.put(key, tiles[key])
+        else:
+            for (tile_x, tile_y), tile_equations in missing.items():
+                if is_cancelled():
+                    return None
+                for equation, layer in zip(tile_equations, self._render_tiles(tile_equations, tile_x, tile_y, step_x, step_y, mode, block_size)):
+                    tiles[get_key(equation, tile_x, tile_y)] = layer
+                    self._tiles.put(get_key(equation, tile_x, tile_y), layer)
+
+        # Put each row of the canvas together from the rows of the tiles it crosses
+        crop = (1 << canvas_width) - 1
+        layers = [Layer(canvas_width, canvas_height) for _ in equations]
+        for y in range(canvas_height):
+            tile_y, tile_row = divmod(top + y, TILE_HEIGHT)
+            for tile_x in tile_xs:
+                shift = tile_x * TILE_WIDTH - left
+                for layer, equation in zip(layers, equations):
+                    row = tiles[get_key(equation, tile_x, tile_y)].rows[tile_row]
+                    layer.rows[y] |= (row << shift if shift >= 0 else row >> -shift) & crop
+        return layers
+
+def render_equations_layer(equations: list[tuple[str, str]], view_left: float, view_right: float, view_top: float, view_bottom: float, canvas_width: int, canvas_height: int, cache: RenderCache | None = None, mode: str = UNIFORM, block_size: int = 8, executor: concurrent.futures.Executor | None = None, process_count: int = 1, is_cancelled: typing.Callable[[], bool] | None = None, resolution: str = CELL, tile_cache: TileCache | None = None) -> Layer | None:
     """
+    Render all the equations and merge them into one layer, the same shape as render_equation gives.
+    This doesn't touch the window, so it is safe to call off the main thread.
+
+    The canvas size is in characters, for resolutions other than CELL the layer has RESOLUTIONS[resolution] times as
+    many samples in each direction, and should be drawn with draw_layer at the same resolution.
+
+    Each equation is compiled once and reused until its text changes, equations that are not valid are skipped.
+    If a cache is given then renders are reused from and stored in it.
+    In the UNIFORM mode, equations that are sampled on this thread are sampled together with sample_equations, so they
+    share the subexpressions they have in common.
+    The mode is one of RENDER_MODES, block_size is used by ADAPTIVE. Equations that are solved for x or y are always
+    rendered with render_solved_band instead.
+
+    If an executor is given then equations are rendered in it, with equations split into horizontal bands
+    when there are fewer equations than process_count.
+    Equations that are solved for x or y are quick enough that they are still rendered on this thread.
+
+    If a tile_cache is given and the view is aligned with its tiles, then equations are put together from tiles
+    instead, with missing tiles rendered in the executor if there is one.
+
+    is_cancelled is checked between the tiles or bands of rows each equation is rendered in, once it returns True this
+    gives up and returns None. Without it, equations rendered on this thread are rendered whole.
+    """
+    canvas_width *= RESOLUTIONS[resolution][0]  # From here on we work in samples rather than characters
+    canvas_height *= RESOLUTIONS[resolution][1]
+    step_x, step_y = get_steps(view_left, view_right, view_top, view_bottom, canvas_width, canvas_height)
+    # Equations rendered on this thread are done in bands, so a cancelled render stops partway through them
+    band_height = TILE_HEIGHT if is_cancelled is not None else max(1, canvas_height)
+    is_cancelled = is_cancelled or (lambda: False)
+
+    layers = {}
+    to_render = []
+    for source in equations:
+        equation = compile_equation(source)
+        if not equation.valid or source in layers:
+            continue
+        key = (source, view_left, view_right, view_top, view_bottom, canvas_width, canvas_height, mode, block_size)
+        layers[source] = cache.get(key) if cache is not None else None
+        if layers[source] is None:
+            to_render.append(source)
+
+    if tile_cache is not None and tile_cache.is_aligned(view_left, view_top, step_x, step_y) and to_render:
+        tiled_layers = tile_cache.render([compile_equation(source) for source in to_render], view_left, view_top, step_x, step_y, canvas_width, canvas_height, mode, block_size, executor, is_cancelled)
+        if tiled_layers is None:
+            return None
+        layers.update(zip(to_render, tiled_layers))
+
+    to_render_in_executor = [source for source in to_render if layers[source] is None and compile_equation(source).solved_for is None] if executor is not None else []
+    if to_render_in_executor:
+        # Give each equation an equal share of the processes, in bands of rows
+        band_count = max(1, min(canvas_height, process_count // len(to_render_in_executor)))
+        bands = [(canvas_height * n // band_count, canvas_height * (n + 1) // band_count) for n in range(band_count)]
+        futures = {source: [
+            executor.submit(_render_band_in_worker, source, view_left, view_top, step_x, step_y, canvas_width, row_start, row_end, mode, block_size)
+            for row_start, row_end in bands
+        ] for source in to_render_in_executor}
+        for source, band_futures in futures.items():
+            with profiling.section("equation " + "=".join(source)):  # Only the time spent waiting for it, as it renders in parallel
+                bands = []
+                for band_future in band_futures:
+                    if is_cancelled():
+                        for future in [future for band_futures in futures.values() for future in band_futures]:
+                            future.cancel()
+                        return None
+                    band, evaluations = band_future.result()
+                    profiling.add_evaluations(evaluations)
+                    bands.append(band)
+                layers[source] = Layer(canvas_width, canvas_height, [row for band in bands for row in band.rows])
+
+    bands = [(row_start, min(row_start + band_height, canvas_height)) for row_start in range(0, canvas_height, band_height)]
+
+    # These are all sampled at once, so they can share work
+    to_sample = [source for source in to_render if layers[source] is None and mode == UNIFORM and compile_equation(source).solved_for is None]
+    if to_sample:
+        band_rows = {source: [] for source in to_sample}
+        with profiling.section("equations " + ", ".join("=".join(source) for source in to_sample)):
+            for row_start, row_end in bands:
+                if is_cancelled():
+                    return None
+                # With the padding trace_line expects
+                above_below_maps = sample_equations([compile_equation(source) for source in to_sample], view_left - step_x, view_top - step_y * (row_start - 1),
+                                                    step_x, step_y, canvas_width + 2, row_end - row_start + 2)
+                for source, above_below_map in zip(to_sample, above_below_maps):
+                    band_rows[source] += trace_line(above_below_map).rows
+        for source in to_sample:
+            layers[source] = Layer(canvas_width, canvas_height, band_rows[source])
+
+    for source in to_render:
+        if layers[source] is not None:
+            continue
+        equation = compile_equation(source)
+        rows = []
+        with profiling.section("equation " + "=".join(source)):
+            for row_start, row_end in bands:
+                if is_cancelled():
+                    return None
+                rows += render_equation_band(equation, view_left, view_top, step_x, step_y, canvas_width, row_start, row_end, mode, block_size).rows
+        layers[source] = Layer(canvas_width, canvas_height, rows)
 
+    if cache is not None:
+        for source in to_render:
+            cache.put((source, view_left, view_right, view_top, view_bottom, canvas_width, canvas_height, mode, block_size), layers[source])
+
+    return merge_layers(list(layers.values()), canvas_width, canvas_height)
+
+def render_equations_progressively(equations: list[tuple[str, str]], view_left: float, view_right: float, view_top: float, view_bottom: float, canvas_width: int, canvas_height: int, cache: RenderCache | None = None, mode: str = UNIFORM, block_size: int = 8, executor: concurrent.futures.Executor | None = None, process_count: int = 1, resolution: str = CELL, factors: tuple[int, ...] = PROGRESSIVE_FACTORS, tile_cache: TileCache | None = None, is_cancelled: typing.Callable[[], bool] | None = None):
+    """
+    A generator that renders the same as render_equations_layer in passes, yielding a layer after each one.
+    Each pass only samples every factor'th sample in each direction and draws them as factor * factor blocks, so a
+    rough graph can be shown quickly and refined after. The last factor should be 1, which gives the full render.
+    Stop iterating to abandon the passes that are left, e.g. once the view has changed. If is_cancelled is given and
+    returns True during a pass, then that pass yields None and no more passes are done.
+
+    Only the full pass uses the tile_cache, as the coarse samples don't line up with the full ones.
+    The coarse passes are skipped when every equation is already in the cache, or no more than PROGRESSIVE_MAX_MISSING
+    of their tiles are missing from the tile_cache, as then the full pass is quicker than the coarse ones.
+    """
+    sub_width, sub_height = RESOLUTIONS[resolution]
+    width, height = canvas_width * sub_width, canvas_height * sub_height  # In samples
+    step_x, step_y = get_steps(view_left, view_right, view_top, view_bottom, width, height)
+    if cache is not None or tile_cache is not None:
+        uncached = [compile_equation(source) for source in equations if compile_equation(source).valid and (cache is None or cache.get(
+            (source, view_left, view_right, view_top, view_bottom, width, height, mode, block_size)) is None)]
+        if not uncached or tile_cache is not None and \
+                tile_cache.get_missing_fraction(uncached, view_left, view_top, step_x, step_y, width, height, mode, block_size) <= PROGRESSIVE_MAX_MISSING:
+            factors = (1,)
+    for factor in factors:
+        if factor == 1:
+            yield render_equations_layer(equations, view_left, view_right, view_top, view_bottom, canvas_width, canvas_height, cache,
+                                         mode, block_size, executor, process_count, is_cancelled, resolution, tile_cache)
+            return
+        coarse_width, coarse_height = -(-width // factor), -(-height // factor)
+        if coarse_width < 2 or coarse_height < 2:
+            continue  # There is no step between samples this coarse
+        layer = render_equations_layer(equations, view_left, view_left + step_x * factor * (coarse_width - 1),
+                                       view_top, view_top - step_y * factor * (coarse_height - 1), coarse_width, coarse_height,
+                                       cache, mode, block_size, executor, process_count, is_cancelled)
+        if layer is None:
+            yield None
+            return
+        yield layer.scale(factor, width, height)
+
+def draw_layer(window: "Window", layer: Layer | None, canvas_x: int, canvas_y: int, canvas_width: int, canvas_height: int, resolution: str = CELL):
+    """
+    Draw a layer from render_equations_layer onto the given window, clearing the canvas first.
+    The resolution should be the one the layer was rendered at.
+    If the layer is None, or was rendered for a different canvas size, then only the clearing is done.
+    """
     window.draw_rectangle(canvas_x, canvas_y, canvas_width, canvas_height, BLACK)  # Reset canvas cause we will draw transparent images on top of each other.
-    for equation in equations:
-        result = render_equation(equation, view_left, view_right, view_top, view_bottom, canvas_width, canvas_height)
-        window.overlay_text(canvas_x, canvas_y, result, WHITE, BLACK)  # Overlay so we can easily draw multiple graphs and color each separately
+    sub_width, sub_height = RESOLUTIONS[resolution]
+    if layer is not None and (layer.width, layer.height) == (canvas_width * sub_width, canvas_height * sub_height):
+        window.overlay_text(canvas_x, canvas_y, layer.to_glyphs(resolution), WHITE, BLACK)
+
+def render_equations(equations: list[tuple[str, str]], window: "Window", view_left: float, view_right: float, view_top: float, view_bottom: float, canvas_x: int, canvas_y: int, canvas_width: int, canvas_height: int, cache: RenderCache | None = None, mode: str = UNIFORM, block_size: int = 8, resolution: str = CELL):
+    """
+    View parameters are floats, they are the bounding box of the graph world we want to see.
+    Canvas parameters are how it should be drawn onto the window.
+
+    This will render all the equations to the given window, see render_equations_layer for the other parameters.
+    If the window has a process pool then equations are rendered in it.
+    """
+    layer = render_equations_layer(equations, view_left, view_right, view_top, view_bottom, canvas_width, canvas_height, cache, mode, block_size,
+                                   window.get_executor(), window.get_process_count(), resolution=resolution)
+    draw_layer(window, layer, canvas_x, canvas_y, canvas_width, canvas_height, resolution)
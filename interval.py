@@ -0,0 +1,249 @@
+import ast
+import copy
+import functools
+import math
+
+from equation import CONSTANTS, FUNCTIONS, CompiledEquation, build_function
+
+# An interval is (low, high), with both ends included, or None if it is empty (e.g. the log of a negative interval).
+# Ends are not rounded outwards, so a result can be off by the last bit of a float, like the normal evaluation can be.
+
+_EVERYTHING = (-math.inf, math.inf)
+
+
+def _bound(*values: float) -> tuple[float, float]:
+    """
+    The smallest interval containing all the values. A nan (e.g. from inf - inf) could have been anything.
+    """
+    if any(math.isnan(value) for value in values):
+        return _EVERYTHING
+    return min(values), max(values)
+
+
+def _clip(a, low: float, high: float):
+    """
+    The part of a that is in [low, high], used to leave out points that a function isn't defined at.
+    """
+    if a is None or a[1] < low or a[0] > high:
+        return None
+    return max(a[0], low), min(a[1], high)
+
+
+def _increasing(function):
+    """
+    Make the interval version of a function that only ever increases, where an end that is too big or small for the
+    function gives an infinity.
+    """
+    def apply(a):
+        if a is None:
+            return None
+        try:
+            low = function(a[0])
+        except (OverflowError, ValueError):
+            low = -math.inf
+        try:
+            high = function(a[1])
+        except (OverflowError, ValueError):
+            high = math.inf
+        return _bound(low, high)
+    return apply
+
+
+def _add(a, b):
+    if a is None or b is None:
+        return None
+    return _bound(a[0] + b[0], a[1] + b[1])
+
+
+def _sub(a, b):
+    if a is None or b is None:
+        return None
+    return _bound(a[0] - b[1], a[1] - b[0])
+
+
+def _mul(a, b):
+    if a is None or b is None:
+        return None
+    return _bound(a[0] * b[0], a[0] * b[1], a[1] * b[0], a[1] * b[1])
+
+
+def _div(a, b):
+    if a is None or b is None or b == (0, 0):
+        return None
+    if b[0] <= 0 <= b[1]:
+        return _EVERYTHING  # Gets as big as you like next to the 0
+    return _mul(a, (1 / b[1], 1 / b[0]))
+
+
+def _mod(a, b):
+    if a is None or b is None or b == (0, 0):
+        return None
+    if b[0] == b[1] and b[0] > 0:
+        low, high = a[0] / b[0], a[1] / b[0]  # Which period each end is in, which can overflow for tiny b
+        if math.isfinite(low) and math.isfinite(high) and math.floor(low) == math.floor(high):  # All in one period, so it is just shifted
+            shift = math.floor(low) * b[0]
+            return a[0] - shift, a[1] - shift
+    return min(b[0], 0), max(b[1], 0)  # The result has the same sign as b, and is smaller than it
+
+
+def _power(base: float, exponent: float) -> float:
+    try:
+        return float(base ** exponent)
+    except ZeroDivisionError:
+        return math.inf
+    except OverflowError:
+        return -math.inf if base < 0 and exponent % 2 == 1 else math.inf
+
+
+def _pow(a, b):
+    if a is None or b is None:
+        return None
+    if b[0] == b[1] and math.isfinite(b[0]) and b[0] == int(b[0]):  # Integer powers are defined for negative numbers
+        n = int(b[0])
+        if n < 0:
+            return _div((1.0, 1.0), _pow(a, (-n, -n)))
+        low, high = _power(a[0], n), _power(a[1], n)
+        if n % 2 == 0 and a[0] <= 0 <= a[1]:
+            return 0.0 if n else 1.0, max(low, high)
+        return _bound(low, high)
+
+    # Otherwise negative bases give complex numbers, which aren't plotted. Over positive bases the power only ever
+    # increases or decreases with each of the base and exponent, so the corners of the box are the furthest it goes.
+    a = _clip(a, 0, math.inf)
+    if a is None:
+        return None
+    return _bound(*[_power(base, exponent) for base in a for exponent in b])
+
+
+def _neg(a):
+    return None if a is None else (-a[1], -a[0])
+
+
+def _pos(a):
+    return a
+
+
+def _sin(a):
+    if a is None:
+        return None
+    if not a[1] - a[0] < 2 * math.pi:  # Also catches infinite ends
+        return -1.0, 1.0
+    low, high = _bound(math.sin(a[0]), math.sin(a[1]))
+
+    def contains(offset):  # If a contains offset + 2 pi k for any k
+        return math.ceil((a[0] - offset) / (2 * math.pi)) <= math.floor((a[1] - offset) / (2 * math.pi))
+    return -1.0 if contains(-math.pi / 2) else low, 1.0 if contains(math.pi / 2) else high
+
+
+def _cos(a):
+    return _sin(_add(a, (math.pi / 2, math.pi / 2)))
+
+
+def _tan(a):
+    if a is None:
+        return None
+    if not a[1] - a[0] < math.pi or math.ceil((a[0] - math.pi / 2) / math.pi) <= math.floor((a[1] - math.pi / 2) / math.pi):
+        return _EVERYTHING  # Goes past an asymptote
+    return _bound(math.tan(a[0]), math.tan(a[1]))
+
+
+def _acos(a):
+    return None if a is None else (math.acos(a[1]), math.acos(a[0]))
+
+
+def _on_domain(function, low: float, high: float):
+    """
+    Make an interval function only look at the part of its input in [low, high], where it is defined.
+    """
+    return lambda a: function(_clip(a, low, high))
+
+
+def _even(function):
+    """
+    Make the interval version of a function that is smallest at 0 and increases away from it on both sides.
+    """
+    increasing = _increasing(function)
+
+    def apply(a):
+        if a is None:
+            return None
+        if a[0] <= 0 <= a[1]:
+            return function(0), increasing((0, max(-a[0], a[1])))[1]
+        return increasing((min(abs(a[0]), abs(a[1])), max(abs(a[0]), abs(a[1]))))
+    return apply
+
+
+_INTERVAL_FUNCTIONS = {
+    "sin": _sin,
+    "cos": _cos,
+    "tan": _tan,
+    "asin": _on_domain(_increasing(math.asin), -1, 1),
+    "acos": _on_domain(_acos, -1, 1),
+    "atan": _increasing(math.atan),
+    "sinh": _increasing(math.sinh),
+    "cosh": _even(math.cosh),
+    "tanh": _increasing(math.tanh),
+    "exp": _increasing(math.exp),
+    "log": _on_domain(_increasing(math.log), 0, math.inf),  # log(0) is an error, which becomes -inf
+    "log10": _on_domain(_increasing(math.log10), 0, math.inf),
+    "sqrt": _on_domain(_increasing(math.sqrt), 0, math.inf),
+    "abs": _even(abs),
+    "floor": _increasing(FUNCTIONS["floor"][0]),
+    "ceil": _increasing(FUNCTIONS["ceil"][0]),
+}
+"""
+The interval version of each of equation.FUNCTIONS.
+"""
+_OPERATORS = {
+    ast.Add: "_add", ast.Sub: "_sub", ast.Mult: "_mul", ast.Div: "_div", ast.Pow: "_pow", ast.Mod: "_mod",
+    ast.USub: "_neg", ast.UAdd: "_pos",
+}
+"""
+The name in the namespace of the interval version of each operator.
+"""
+
+
+class _ToIntervals(ast.NodeTransformer):
+    """
+    Rewrites a validated expression to work on intervals, by replacing operators and functions with calls to their
+    interval versions and numbers with intervals of just that number.
+    """
+
+    def visit_BinOp(self, node):
+        return ast.Call(ast.Name(_OPERATORS[type(node.op)], ast.Load()), [self.visit(node.left), self.visit(node.right)], [])
+
+    def visit_UnaryOp(self, node):
+        return ast.Call(ast.Name(_OPERATORS[type(node.op)], ast.Load()), [self.visit(node.operand)], [])
+
+    def visit_Call(self, node):
+        return ast.Call(ast.Name("_" + node.func.id, ast.Load()), [self.visit(argument) for argument in node.args], [])
+
+    def visit_Constant(self, node):
+        return ast.Constant((float(node.value), float(node.value)))
+
+    def visit_Name(self, node):
+        if node.id in CONSTANTS:
+            return ast.Constant((CONSTANTS[node.id], CONSTANTS[node.id]))
+        return node
+
+
+@functools.lru_cache(maxsize=256)
+def compile_interval_function(equation: CompiledEquation):
+    """
+    Compile a valid equation into a function of (x interval, y interval), that returns (lhs interval, rhs interval).
+    Each interval contains every value that side takes for the points in the box, and leaves out points where that side
+    isn't defined. Intervals often contain more than this, especially when a variable is used more than once.
+    """
+    body = ast.Tuple([_ToIntervals().visit(copy.deepcopy(equation.lhs)), _ToIntervals().visit(copy.deepcopy(equation.rhs))], ast.Load())
+    namespace = {name: globals()[name] for name in _OPERATORS.values()}
+    namespace.update({"_" + name: function for name, function in _INTERVAL_FUNCTIONS.items()})
+    return build_function(body, namespace, False)
+
+
+def may_cross(interval_function, x: tuple[float, float], y: tuple[float, float]) -> bool:
+    """
+    Returns False if the equation's lhs is certainly never equal to its rhs inside the box of x and y intervals, given
+    the function from compile_interval_function. Returns True if it may be.
+    """
+    lhs, rhs = interval_function(x, y)
+    return lhs is not None and rhs is not None and lhs[0] <= rhs[1] and rhs[0] <= lhs[1]
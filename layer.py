@@ -0,0 +1,152 @@
+from equation import numpy
+
+CELL = "cell"
+"""
+Resolution where each character is one sample, drawn as "#".
+"""
+HALF_BLOCK = "half block"
+"""
+Resolution where each character is two samples stacked vertically, drawn with half block characters.
+"""
+BRAILLE = "braille"
+"""
+Resolution where each character is a 2x4 grid of samples, drawn with Braille characters.
+"""
+RESOLUTIONS = {CELL: (1, 1), HALF_BLOCK: (1, 2), BRAILLE: (2, 4)}
+"""
+The (columns, rows) of samples in each character for each resolution.
+"""
+
+_HALF_BLOCKS = (" ", "▀", "▄", "█")  # Indexed by top + 2 * bottom
+_BRAILLE_DOTS = ((0x01, 0x08), (0x02, 0x10), (0x04, 0x20), (0x40, 0x80))  # The bit of each dot, as _BRAILLE_DOTS[row][column]
+
+
+class Layer:
+    """
+    A rendered equation, stored as a packed bitmap with one int per row, where bit x of a row is set if the cell in
+    column x is drawn.
+    Whole rows can then be combined and compared with single bitwise operations, and a layer is only turned into
+    characters when it is drawn.
+    """
+
+    width: int
+    height: int
+    rows: list[int]
+    """
+    The bits of each row, as rows[y].
+    """
+
+    def __init__(self, width: int, height: int, rows: list[int] | None = None):
+        """
+        Creates a layer of the given size, from the given rows or with nothing drawn.
+        """
+        self.width = width
+        self.height = height
+        self.rows = list(rows) if rows is not None else [0] * height
+
+    def __or__(self, other: "Layer") -> "Layer":
+        assert (self.width, self.height) == (other.width, other.height), "Layers are different sizes"
+        return Layer(self.width, self.height, [a | b for a, b in zip(self.rows, other.rows)])
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Layer) and (self.width, self.height, self.rows) == (other.width, other.height, other.rows)
+
+    def __repr__(self) -> str:
+        return f"Layer({self.width}, {self.height}, {self.rows})"
+
+    def get(self, x: int, y: int) -> bool:
+        return bool(self.rows[y] >> x & 1)
+
+    def get_runs(self, y: int) -> list[tuple[int, int]]:
+        """
+        Returns the runs of drawn cells in the given row, as (start column, length).
+        """
+        runs = []
+        row = self.rows[y]
+        x = 0
+        while row:
+            skip = (row & -row).bit_length() - 1  # How many unset bits before the next set one
+            row >>= skip
+            x += skip
+            length = (row ^ (row + 1)).bit_length() - 1  # How many set bits in a row
+            runs.append((x, length))
+            row >>= length
+            x += length
+        return runs
+
+    def scale(self, factor: int, width: int, height: int) -> "Layer":
+        """
+        Returns this layer with each cell grown into a factor * factor block, cropped to the given size.
+        """
+        crop = (1 << width) - 1
+        rows = []
+        for y in range(self.height):
+            row = 0
+            for start, length in self.get_runs(y):
+                row |= ((1 << (length * factor)) - 1) << (start * factor)
+            rows.extend([row & crop] * factor)
+        rows = rows[:height]
+        return Layer(width, height, rows + [0] * (height - len(rows)))
+
+    def to_glyphs(self, resolution: str) -> list[str]:
+        """
+        Returns each row of characters for drawing this layer at the given resolution, with " " where nothing is drawn.
+        This layer should be the size of the canvas multiplied by RESOLUTIONS[resolution].
+        """
+        if resolution == CELL:
+            return self.to_text()
+
+        columns, rows = RESOLUTIONS[resolution]
+        lines = []
+        for top in range(0, self.height, rows):
+            sub_rows = self.rows[top:top + rows] + [0] * (top + rows - self.height)  # Pad a cut off last line with nothing
+            line = [" "] * ((self.width + columns - 1) // columns)
+            combined = 0
+            for sub_row in sub_rows:
+                combined |= sub_row
+            for start, length in Layer(self.width, 1, [combined]).get_runs(0):  # Only look at characters with something in
+                for x in range(start // columns, (start + length - 1) // columns + 1):
+                    if resolution == HALF_BLOCK:
+                        line[x] = _HALF_BLOCKS[(sub_rows[0] >> x & 1) + 2 * (sub_rows[1] >> x & 1)]
+                    else:
+                        dots = 0
+                        for row, bits in zip(sub_rows, _BRAILLE_DOTS):
+                            for column, bit in enumerate(bits):
+                                if row >> (x * columns + column) & 1:
+                                    dots |= bit
+                        line[x] = chr(0x2800 + dots)
+            lines.append("".join(line))
+        return lines
+
+    def to_text(self, char: str = "#") -> list[str]:
+        """
+        Returns each row as a string, with the given char where cells are drawn and " " elsewhere.
+        """
+        lines = []
+        for y in range(self.height):
+            line = ""
+            for start, length in self.get_runs(y):
+                line += " " * (start - len(line)) + char * length
+            lines.append(line.ljust(self.width))
+        return lines
+
+
+def pack_rows(above_below_map) -> list[int]:
+    """
+    Pack each row of an above_below_map (a NumPy bool array, or lists of bools) into an int, with bit x set if the
+    value in column x is true.
+    """
+    if numpy is not None and isinstance(above_below_map, numpy.ndarray):
+        packed = numpy.packbits(above_below_map, axis=1, bitorder="little")
+        return [int.from_bytes(row.tobytes(), "little") for row in packed]
+    return [sum(1 << x for x, value in enumerate(row) if value) for row in above_below_map]
+
+
+def merge_layers(layers: list[Layer], width: int, height: int) -> Layer:
+    """
+    Combine layers into one, where a cell is drawn if it is drawn in any of them.
+    """
+    result = Layer(width, height)
+    for layer in layers:
+        result = result | layer
+    return result
@@ -1,7 +1,16 @@
 import curses
+import os
+import sys
+import threading
+import time
+import typing
 
-from graph_rendering_utils import render_equations
-from window import Window, Widget, BLACK, WHITE, UP_ARROW, DOWN_ARROW
+import profiling
+from equation import compile_equation, numpy
+from graph_rendering_utils import render_equations_layer, render_equations_progressively, draw_layer, RenderCache, TileCache, RENDER_MODES
+from layer import Layer, CELL, RESOLUTIONS
+from session import load_session, save_session
+from window import Window, Widget, REDRAW_STATIC, MAX_FRAME_RATE, BLACK, WHITE, UP_ARROW, DOWN_ARROW, LEFT_ARROW, RIGHT_ARROW, KEY_CODE_WIDTH
 
 
 class TopBar(Widget):
@@ -12,6 +21,12 @@ class TopBar(Widget):
     def draw(self, window: "Window"):
         window.draw_centered_text(0, 0, window.get_size()[0], 1, "consoleGraphingProgram.py", BLACK, WHITE)
 
+    def get_refresh_policy(self) -> str:
+        return REDRAW_STATIC
+
+    def get_region(self, window: "Window") -> tuple[int, int, int, int]:
+        return 0, 0, window.get_size()[0], 1
+
     def handle_key(self, key_code: int):
         pass
 
@@ -30,7 +45,29 @@ class BottomBar(Widget):
     Lists the focusable widgets, and which one is currently focussed. It also displays the controls.
     """
 
+    _drawn_state: tuple | None
+    """
+    The state from _get_state when this was last drawn.
+    """
+
+    def __init__(self):
+        self._drawn_state = None
+
+    def _get_state(self, window: "Window") -> tuple:
+        """
+        Everything that this widget draws depends on.
+        """
+        focussed_widget = next(widget for widget in window.get_widgets() if window.query_focussed(widget))
+        return focussed_widget, focussed_widget.get_current_action_string(), tuple(focussed_widget.get_control_descriptions().items())
+
+    def needs_redraw(self, window: "Window") -> bool:
+        return self._get_state(window) != self._drawn_state
+
+    def get_region(self, window: "Window") -> tuple[int, int, int, int]:
+        return 0, window.get_size()[1] - 1, window.get_size()[0], 1
+
     def draw(self, window: "Window"):
+        self._drawn_state = self._get_state(window)
         y = window.get_size()[1] - 1
 
         # Draw the background black to draw the list of focus options on
@@ -55,12 +92,17 @@ class BottomBar(Widget):
         controls = focussed_widget.get_control_descriptions()
         # Add global controls
         controls["(Tab)"] = "Switch Mode"
-        controls["q"] = "Quit"
+        if not focussed_widget.is_taking_text():
+            controls["q"] = "Quit"
 
         x+= 1  # Padding
+        end = window.get_size()[0] - KEY_CODE_WIDTH - 2  # Leave space for the key code in the bottom right
+        current_action = current_action[:max(0, end - x)]
         window.draw_text(x, y, current_action, BLACK, WHITE)
         x += len(current_action) + 1
         for key, description in controls.items():
+            if x + len(key) + 1 + len(description) + 2 > end:
+                break  # Stop once the controls don't fit
             window.draw_text(x, y, key, WHITE, BLACK)
             x += len(key) + 1
             window.draw_text(x, y, description + ", ", BLACK, WHITE)
@@ -80,6 +122,25 @@ class BottomBar(Widget):
 
 EQUATION_EDITOR_WIDTH = 40
 
+ZOOM_BASE_STEP = (1 / 16, 1 / 8)
+"""
+The (x, y) distance in the graph world between the centers of two adjacent characters of the GraphViewer at zoom level 0.
+Characters are about twice as tall as they are wide, so this keeps circles round.
+"""
+EDIT_RENDER_DELAY = 200
+"""
+How many milliseconds the equations have to stay the same after being edited before they are rendered, so typing
+doesn't start a render for every key.
+"""
+DEFAULT_SESSION_PATH = "session.cgp"
+"""
+Where the equations, view and rendered tiles are saved on exit and loaded from on start, unless --session is given.
+"""
+
+MIN_ZOOM = -16
+MAX_ZOOM = 32  # Much further and the steps get too small for floats to pan by
+MAX_PAN = 2 ** 48  # The steps are powers of two, so views up to this many characters from the origin are exact floats
+
 class EquationEditor(Widget):
     """
     A widget to allow for the displaying and editing of equations.
@@ -99,18 +160,37 @@ class EquationEditor(Widget):
     The integer of the index of the cursor. Or None if we are not currently editing.
     """
 
+    _drawn_state: tuple | None
+    """
+    The state from _get_state when this was last drawn.
+    """
+
     def __init__(self, equations_list):
         self._equations = equations_list
         self._current_selected = 0
         self._currently_editing = None
+        self._drawn_state = None
+
+    def _get_state(self, window: "Window") -> tuple:
+        """
+        Everything that this widget draws depends on.
+        """
+        return tuple(self._equations), self._current_selected, self._currently_editing, window.query_focussed(self)
+
+    def needs_redraw(self, window: "Window") -> bool:
+        return self._get_state(window) != self._drawn_state
+
+    def get_region(self, window: "Window") -> tuple[int, int, int, int]:
+        return 0, 1, EQUATION_EDITOR_WIDTH, window.get_size()[1] - 2
 
     def draw(self, window: "Window"):
+        self._drawn_state = self._get_state(window)
         # Draw the background white to draw the other information on
         window.draw_rectangle(0, 1, EQUATION_EDITOR_WIDTH, window.get_size()[1] - 2, WHITE)  # -1 from width so we don't draw the last character.
 
         # Write equations
         for n, (lhs, rhs) in enumerate(self._equations):
-            prefix = str(n + 1) + "."
+            prefix = str(n + 1) + ("." if compile_equation((lhs, rhs)).valid else "!")  # Mark equations that can't be drawn
             window.draw_text(0, n + 1, prefix, BLACK, WHITE)
 
             equation = lhs + "=" + rhs
@@ -140,12 +220,21 @@ class EquationEditor(Widget):
                     self._equations[self._current_selected][0] + chr(key_code),
                     self._equations[self._current_selected][1]
                 )
+                compile_equation(self._equations[self._current_selected])  # Check the new text now rather than when drawing
+
+    def is_taking_text(self) -> bool:
+        return self._currently_editing is not None
 
     def focus_name(self) -> str:
         return "Edit"
 
     def get_current_action_string(self) -> str:
-        return "You are editing an equation" if self._currently_editing is not None else "You are selecting an equation"
+        action = "You are editing an equation" if self._currently_editing is not None else "You are selecting an equation"
+        if self._equations:
+            error = compile_equation(self._equations[self._current_selected]).error
+            if error is not None:
+                action += " (" + error + ")"
+        return action
 
     def get_control_descriptions(self) -> dict[str, str]:
         if self._currently_editing is not None:
@@ -154,37 +243,380 @@ class EquationEditor(Widget):
             return {"⌃⌄": "Select Equation", "↵": "Edit Equation", "+/-": "Add/Remove Equation"}
 
 
+class RenderRequest(typing.NamedTuple):
+    """
+    Everything that a render of the GraphViewer depends on.
+    """
+    equations: tuple[tuple[str, str], ...]
+    view_left: float
+    view_right: float
+    view_top: float
+    view_bottom: float
+    canvas_width: int
+    canvas_height: int
+    mode: str
+    resolution: str
+
+
 class GraphViewer(Widget):
     """
     A widget that draws the equations onto a graph, and allows for panning and zooming.
     This takes a reference to a list of equations to allow for sharing it between this and the EquationEditor.
-    # TODO: Zooming
+    Zoom levels are powers of two apart, and the samples of every level sit on a lattice from the origin, so renders
+    are kept as tiles that can be reused whenever that part of the graph is shown at that level again, which is also
+    what makes panning cheap.
     """
 
     _equations: list[tuple[str, str]]
     """
     A list of all the equations, storing (lhs, rhs).
     """
+    _render_cache: RenderCache
+    """
+    Renders of each equation, so frames where the graph hasn't changed don't render it again.
+    """
+    _tile_cache: TileCache
+    """
+    Tiles of each equation at each zoom level that has been shown, so they can be reused when panning and zooming.
+    """
+    _typed_equations: tuple[tuple[str, str], ...] | None
+    """
+    The equations as they were last seen, where each one that doesn't compile is replaced with what it was before, so
+    text that is half typed keeps showing the last version of it that could be drawn.
+    """
+    _typed_at: float
+    """
+    When _typed_equations last changed, from time.perf_counter.
+    """
+    _settled_equations: tuple[tuple[str, str], ...] | None
+    """
+    The equations that are rendered, which is _typed_equations once it has stayed the same for EDIT_RENDER_DELAY.
+    """
+    _pan_x: int
+    """
+    How many characters right (for _pan_x) or up (for _pan_y) of the origin the center of the view is, at the current
+    zoom level. These are whole characters so that the samples from before the pan line up with the new ones.
+    """
+    _pan_y: int
+    _zoom: int
+    """
+    The zoom level, each one in shows the graph twice as big as the last.
+    """
+    _mode: str
+    """
+    Which of the RENDER_MODES to draw the equations with.
+    """
+    _resolution: str
+    """
+    Which of the RESOLUTIONS to draw the equations at.
+    """
+    _asynchronous: bool
+    """
+    If true then equations are rendered on a background thread, and the last finished render is drawn until it is done.
+    """
+    _progressive: bool
+    """
+    If true then equations are rendered in coarse to fine passes. If _asynchronous is also true then the passes are
+    rendered on the background thread, and each one is drawn as it finishes. Otherwise they are rendered between the
+    window's checks for keys, which holds keys up for as long as a pass takes.
+    """
+    _progress: typing.Iterator | None
+    """
+    The passes of the progressive render that is in progress between checks for keys, or None if there isn't one.
+    """
+    _requested: RenderRequest | None
+    """
+    The newest render that has been asked for.
+    """
+    _finished: tuple[RenderRequest, Layer, bool] | None
+    """
+    The newest render that has finished, as (its request, the layer, if it is the full render). For progressive renders
+    this is the newest pass, which is only full once the last pass is done.
+    """
+    _failed: tuple[RenderRequest, str] | None
+    """
+    The newest render that raised an error, and the error, so the viewer doesn't wait for it forever.
+    """
+    _generation: int
+    """
+    Counts up every time a render is requested, so background renders can tell if they have been overtaken.
+    """
+    _render_lock: threading.Lock
+    """
+    Held while a render or pass is stored in _finished or _failed, so one that has been overtaken can't replace a newer
+    one. Renders themselves run at once, and are stopped between tiles and bands once they are overtaken.
+    """
+    _drawn: tuple[RenderRequest, Layer, bool] | None
+    """
+    What _finished was when this was last drawn.
+    """
 
-    def __init__(self, equations_list):
+    def __init__(self, equations_list, asynchronous: bool = True, progressive: bool = False, tile_cache: TileCache | None = None):
         self._equations = equations_list
+        self._render_cache = RenderCache()
+        self._tile_cache = tile_cache if tile_cache is not None else TileCache()
+        self._typed_equations = None
+        self._typed_at = 0
+        self._settled_equations = None
+        self._pan_x = 0
+        self._pan_y = 0
+        self._zoom = 0
+        self._mode = RENDER_MODES[0]
+        self._resolution = CELL
+        self._asynchronous = asynchronous
+        self._progressive = progressive
+        self._progress = None
+        self._requested = None
+        self._finished = None
+        self._failed = None
+        self._generation = 0
+        self._render_lock = threading.Lock()
+        self._drawn = None
+
+    def _get_equations(self) -> tuple[tuple[str, str], ...]:
+        """
+        Returns the equations that should currently be rendered, leaving out any that can't be drawn.
+        Edits are only rendered once they stop for EDIT_RENDER_DELAY, the caches are per equation so then only the
+        edited one is rendered again.
+        """
+        previous = self._typed_equations or ()
+        typed = tuple(source if compile_equation(source).valid or len(previous) != len(self._equations) else previous[n]
+                      for n, source in enumerate(self._equations))
+        now = time.perf_counter()
+        if typed != self._typed_equations:
+            self._typed_equations, self._typed_at = typed, now
+        if self._settled_equations is None or (now - self._typed_at) * 1000 >= EDIT_RENDER_DELAY:
+            self._settled_equations = typed
+        return tuple(source for source in self._settled_equations if compile_equation(source).valid)
+
+    def _get_request(self, window: "Window") -> RenderRequest:
+        """
+        Returns the render that should currently be shown.
+        """
+        canvas_width = window.get_size()[0] - EQUATION_EDITOR_WIDTH
+        canvas_height = window.get_size()[1] - 2
+        sub_width, sub_height = RESOLUTIONS[self._resolution]
+        # Halving powers of two is exact, so every view at a zoom level has exactly the same step and lines up with the tiles
+        step_x = ZOOM_BASE_STEP[0] / 2 ** self._zoom / sub_width
+        step_y = ZOOM_BASE_STEP[1] / 2 ** self._zoom / sub_height
+        view_left = (self._pan_x - canvas_width // 2) * sub_width * step_x
+        view_top = (self._pan_y + canvas_height // 2) * sub_height * step_y
+        return RenderRequest(self._get_equations(),
+                             view_left, view_left + (canvas_width * sub_width - 1) * step_x,
+                             view_top, view_top - (canvas_height * sub_height - 1) * step_y,
+                             canvas_width, canvas_height, self._mode, self._resolution)
+
+    def needs_redraw(self, window: "Window") -> bool:
+        # Either a new render needs starting, or one has finished since we last drew
+        return self._get_request(window) != self._requested or self._finished is not self._drawn
+
+    def get_region(self, window: "Window") -> tuple[int, int, int, int]:
+        return EQUATION_EDITOR_WIDTH, 1, window.get_size()[0] - EQUATION_EDITOR_WIDTH, window.get_size()[1] - 2
 
     def draw(self, window: "Window"):
-        render_equations(self._equations, window, -2, 2, 2, -2, EQUATION_EDITOR_WIDTH, 1, window.get_size()[0] - EQUATION_EDITOR_WIDTH, window.get_size()[1] - 2)
+        request = self._get_request(window)
+
+        if request != self._requested:
+            self._requested = request
+            self._generation += 1
+            if self._finished is not None and self._finished[2] and self._finished[0] == request:  # Already rendered, e.g. by a saved session
+                self._progress = None
+            elif self._progressive and self._asynchronous:
+                self._progress = None
+                threading.Thread(target=self._render_in_passes, args=(request, self._generation, window.get_executor(), window.get_process_count()), daemon=True).start()
+            elif self._progressive:  # This drops the last one's passes
+                self._progress = self._render_progressively(request, window.get_executor(), window.get_process_count())
+            elif self._asynchronous:
+                threading.Thread(target=self._render, args=(request, self._generation, window.get_executor(), window.get_process_count()), daemon=True).start()
+            else:
+                self._render(request, self._generation, window.get_executor(), window.get_process_count())
+
+        # Until the newest render finishes we keep showing the last one
+        self._drawn = self._finished
+        if self._drawn is not None:
+            draw_layer(window, self._drawn[1], EQUATION_EDITOR_WIDTH, 1, request.canvas_width, request.canvas_height, self._drawn[0].resolution)
+        else:
+            draw_layer(window, None, EQUATION_EDITOR_WIDTH, 1, request.canvas_width, request.canvas_height)
+
+    def _render(self, request: RenderRequest, generation: int, executor, process_count: int):
+        """
+        Render the given request and store it in _finished, unless a newer render is requested before this finishes.
+        This can be run on any thread.
+        """
+        is_cancelled = lambda: generation != self._generation
+        try:
+            layer = render_equations_layer(list(request.equations), request.view_left, request.view_right, request.view_top,
+                                           request.view_bottom, request.canvas_width, request.canvas_height,
+                                           self._render_cache, request.mode, executor=executor,
+                                           process_count=process_count, is_cancelled=is_cancelled,
+                                           resolution=request.resolution, tile_cache=self._tile_cache)
+        except Exception as e:  # Otherwise the thread dies printing over the screen, and the render never finishes
+            with self._render_lock:
+                if not is_cancelled():
+                    self._failed = (request, repr(e))
+            return
+        with self._render_lock:
+            if layer is not None and not is_cancelled():
+                self._finished = (request, layer, True)
+
+    def _render_in_passes(self, request: RenderRequest, generation: int, executor, process_count: int):
+        """
+        Render all the passes of the given request with _render_progressively, unless a newer render is requested first.
+        This can be run on any thread.
+        """
+        is_cancelled = lambda: generation != self._generation
+        try:
+            for _ in self._render_progressively(request, executor, process_count, is_cancelled):
+                pass
+        except Exception as e:  # The same as in _render
+            with self._render_lock:
+                if not is_cancelled():
+                    self._failed = (request, repr(e))
+
+    def _render_progressively(self, request: RenderRequest, executor, process_count: int, is_cancelled: typing.Callable[[], bool] | None = None):
+        """
+        A generator that renders the given request a pass at a time, storing each pass in _finished.
+        Once is_cancelled returns True this stops, leaving the last finished pass.
+        """
+        for layer in render_equations_progressively(list(request.equations), request.view_left, request.view_right, request.view_top,
+                                                    request.view_bottom, request.canvas_width, request.canvas_height,
+                                                    self._render_cache, request.mode, executor=executor,
+                                                    process_count=process_count, resolution=request.resolution,
+                                                    tile_cache=self._tile_cache, is_cancelled=is_cancelled):
+            with self._render_lock:
+                if layer is None or is_cancelled is not None and is_cancelled():  # Don't replace a newer render's pass
+                    return
+                self._finished = (request, layer, False)
+            yield
+        with self._render_lock:
+            if self._finished is not None and self._finished[0] == request:
+                self._finished = (request, self._finished[1], True)  # The last pass was the full render
+
+    def is_busy(self) -> bool:
+        # A coarse pass of the newest render still has finer passes coming
+        waiting = self._finished is None or self._finished[0] != self._requested or not self._finished[2]
+        if self._failed is not None and self._failed[0] == self._requested:
+            waiting = False  # It isn't going to finish
+        # Waiting for typing to stop counts, so the window checks again once it has
+        return waiting or self._settled_equations != self._typed_equations
+
+    def get_view_state(self) -> dict:
+        """
+        Everything about how the graph is viewed, as a dict that can be saved as JSON.
+        """
+        return {"pan_x": self._pan_x, "pan_y": self._pan_y, "zoom": self._zoom, "mode": self._mode, "resolution": self._resolution}
+
+    def set_view_state(self, view: dict):
+        """
+        Restore the view from get_view_state, anything missing or unknown is left as it is.
+        """
+        self._pan_x = view["pan_x"] if type(view.get("pan_x")) is int and abs(view["pan_x"]) <= MAX_PAN else self._pan_x
+        self._pan_y = view["pan_y"] if type(view.get("pan_y")) is int and abs(view["pan_y"]) <= MAX_PAN else self._pan_y
+        self._zoom = min(max(view["zoom"], MIN_ZOOM), MAX_ZOOM) if type(view.get("zoom")) is int else self._zoom
+        self._mode = view["mode"] if view.get("mode") in RENDER_MODES else self._mode
+        self._resolution = view["resolution"] if view.get("resolution") in RESOLUTIONS else self._resolution
+
+    def get_tile_cache(self) -> TileCache:
+        return self._tile_cache
+
+    def get_last_frame(self) -> tuple[list, Layer] | None:
+        """
+        The fields of the request of the last frame that was drawn, and its layer, or None if nothing has been drawn or
+        it was only a coarse pass of a progressive render.
+        """
+        if self._drawn is None or not self._drawn[2]:
+            return None
+        return list(self._drawn[0]), self._drawn[1]
+
+    def set_last_frame(self, fields: list, layer: Layer):
+        """
+        Show a frame from get_last_frame (e.g. from a saved session) until the first render finishes, if it fits.
+        If the view is the same as it was then it doesn't need rendering at all.
+        Fields that don't make a request that can be drawn are ignored.
+        """
+        try:
+            request = RenderRequest(tuple((str(lhs), str(rhs)) for lhs, rhs in fields[0]), *fields[1:])
+        except (TypeError, ValueError, IndexError):
+            return
+        if request.resolution in RESOLUTIONS:
+            self._finished = (request, layer, True)
+
+    def has_pending_work(self) -> bool:
+        return self._progress is not None
+
+    def do_pending_work(self):
+        try:
+            next(self._progress)
+        except StopIteration:
+            self._progress = None
+        except Exception as e:  # The same as in _render, the passes are always for the newest request
+            self._progress = None
+            self._failed = (self._requested, repr(e))
 
     def handle_key(self, key_code: int):
-        pass
+        if key_code == LEFT_ARROW and self._pan_x > -MAX_PAN:
+            self._pan_x -= 1
+        elif key_code == RIGHT_ARROW and self._pan_x < MAX_PAN:
+            self._pan_x += 1
+        elif key_code == UP_ARROW and self._pan_y < MAX_PAN:
+            self._pan_y += 1
+        elif key_code == DOWN_ARROW and self._pan_y > -MAX_PAN:
+            self._pan_y -= 1
+        elif key_code in (ord("+"), ord("=")) and self._zoom < MAX_ZOOM and max(abs(self._pan_x), abs(self._pan_y)) * 2 <= MAX_PAN:
+            self._zoom += 1
+            self._pan_x, self._pan_y = self._pan_x * 2, self._pan_y * 2  # Keep the same point in the center
+        elif key_code == ord("-") and self._zoom > MIN_ZOOM:
+            self._zoom -= 1
+            self._pan_x, self._pan_y = self._pan_x // 2, self._pan_y // 2
+        elif key_code == ord("m"):
+            self._mode = RENDER_MODES[(RENDER_MODES.index(self._mode) + 1) % len(RENDER_MODES)]
+        elif key_code == ord("r"):
+            resolutions = list(RESOLUTIONS)
+            self._resolution = resolutions[(resolutions.index(self._resolution) + 1) % len(resolutions)]
 
     def focus_name(self) -> str:
         return "Pan"
 
     def get_current_action_string(self) -> str:
-        return "You are panning the graph"
+        action = "You are panning the graph (" + self._mode + ", " + self._resolution + ", zoom " + str(self._zoom) + ")"
+        if self._failed is not None and self._failed[0] == self._requested:
+            action += " (rendering failed: " + self._failed[1] + ")"
+        return action
 
     def get_control_descriptions(self) -> dict[str, str]:
-        return {"<⌃⌄>": "Pan the graph"}
+        return {"<⌃⌄>": "Pan the graph", "+-": "Zoom", "m": "Change Render Mode", "r": "Change Resolution"}
 
 if __name__ == "__main__":
-    equations = [("x - y","0")]#, ("x**2+y**2", "1")]
-    window = Window([EquationEditor(equations), TopBar(), BottomBar(), GraphViewer(equations)])
-    window.mainloop()
+    # Run with `--session file` to use a different session file
+    session_path = DEFAULT_SESSION_PATH
+    if "--session" in sys.argv:
+        session_path = sys.argv[sys.argv.index("--session") + 1]
+    session = load_session(session_path)
+    # Something that isn't a session is left alone rather than saved over
+    can_save = session is not None or not os.path.exists(session_path)
+
+    equations = session.equations if session is not None else [("x - y","0")]#, ("x**2+y**2", "1")]
+    # The passes are rendered on a background thread, so keys are still handled at once while they render
+    graph_viewer = GraphViewer(equations, progressive=True, tile_cache=TileCache(stored=session.tiles if session is not None else None))
+    if session is not None:
+        graph_viewer.set_view_state(session.view)
+        if session.last_frame is not None:
+            graph_viewer.set_last_frame(*session.last_frame)
+
+    # Run with `--profile [file]` to show frame timings, and write them to the file if one is given
+    profiler = None
+    if "--profile" in sys.argv:
+        arguments = sys.argv[sys.argv.index("--profile") + 1:]
+        profiler = profiling.Profiler(arguments[0] if arguments and not arguments[0].startswith("--") else None)
+
+    # Without NumPy, rendering is slow enough to be worth spreading over processes
+    # Drawing is given as long as a frame at the maximum frame rate, anything that doesn't fit waits for the next frame
+    window = Window([EquationEditor(equations), TopBar(), BottomBar(), graph_viewer], os.cpu_count() if numpy is None else None, profiler,
+                    1000 // MAX_FRAME_RATE)
+    try:
+        window.mainloop()
+    finally:
+        if can_save:
+            save_session(session_path, equations, graph_viewer.get_view_state(), graph_viewer.get_tile_cache().get_tiles(), graph_viewer.get_last_frame())
+        else:
+            print(f"{session_path} isn't a session file, so the session wasn't saved over it", file=sys.stderr)
@@ -0,0 +1,103 @@
+import curses
+
+from window import Window, Widget
+
+
+class OffscreenScreen:
+    """
+    Stands in for a curses screen, keeping what is drawn in memory instead of sending it to a terminal.
+    Only the calls that Window makes are supported, and they behave like curses' do (e.g. text wraps onto the next row,
+    and writing the bottom right cell is an error as the cursor can't move past it, though the character is still drawn).
+    """
+
+    _size: tuple[int, int]
+    """
+    The size of the screen as (rows, columns), the same as getmaxyx.
+    """
+    _chars: list[list[str]]
+    """
+    The character in each cell, as _chars[y][x].
+    """
+    _attributes: list[list[int]]
+    """
+    The attribute each cell was drawn with, as _attributes[y][x].
+    """
+    _attribute: int  # The attribute that is currently on
+
+    def __init__(self, width: int, height: int):
+        self._size = (height, width)
+        self._attribute = 0
+        self.erase()
+
+    def getmaxyx(self) -> tuple[int, int]:
+        return self._size
+
+    def erase(self):
+        self._chars = [[" "] * self._size[1] for _ in range(self._size[0])]
+        self._attributes = [[0] * self._size[1] for _ in range(self._size[0])]
+
+    def clear(self):
+        self.erase()
+
+    def attron(self, attribute: int):
+        self._attribute = attribute
+
+    def addstr(self, y: int, x: int, text: str):
+        if not (0 <= y < self._size[0] and 0 <= x < self._size[1]):
+            raise curses.error("addstr() returned ERR")
+        for char in text:
+            if y >= self._size[0]:
+                raise curses.error("addstr() returned ERR")  # Ran off the end of the screen
+            self._chars[y][x] = char
+            self._attributes[y][x] = self._attribute
+            x += 1
+            if x == self._size[1]:
+                x = 0
+                y += 1
+        if y == self._size[0]:
+            raise curses.error("addstr() returned ERR")  # The cursor was left past the bottom right cell
+
+    def addch(self, y: int, x: int, char: str):
+        self.addstr(y, x, char)
+
+    def get_lines(self) -> list[str]:
+        """
+        Returns each row of the screen as a string.
+        """
+        return ["".join(row) for row in self._chars]
+
+
+class OffscreenWindow(Window):
+    """
+    A window that draws into an OffscreenScreen, so widgets and render_equations can be used without a terminal.
+    This has the same drawing functions as Window, but instead of a mainloop each frame is drawn with draw_frame.
+    """
+
+    def __init__(self, widgets: tuple[Widget], width: int, height: int, screen: OffscreenScreen | None = None):
+        """
+        Creates a window of the given size, drawing to the given screen or a new OffscreenScreen.
+        """
+        super().__init__(widgets)
+        self._stdscr = screen if screen is not None else OffscreenScreen(width, height)
+        self._size = self._stdscr.getmaxyx()
+
+    def _get_color_attribute(self, color: tuple[int, int]) -> int:
+        if color not in self._color_pairs:  # Number them the same way as curses pairs, without needing curses
+            self._color_pairs[color] = len(self._color_pairs) + 1
+        return self._color_pairs[color]
+
+    def draw_frame(self):
+        """
+        Draw every widget once, as the mainloop would after a resize.
+        """
+        for widget in self._widgets:
+            widget.draw(self)
+
+    def get_screen(self) -> OffscreenScreen:
+        return self._stdscr
+
+    def get_lines(self) -> list[str]:
+        """
+        Returns each row of what has been drawn as a string.
+        """
+        return self._stdscr.get_lines()
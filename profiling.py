@@ -0,0 +1,169 @@
+import collections
+import contextlib
+import json
+import threading
+import time
+
+
+class Profiler:
+    """
+    Records how long each part of a frame takes, and how many times equations were evaluated in it.
+    Times are recorded in named sections, which are added up over the frame. When the frame ends, the totals are kept
+    for the summary and written as a line of JSON to the export file if there is one.
+    """
+
+    _sections: dict[str, float]
+    """
+    The seconds spent in each section so far this frame.
+    """
+    _evaluations: int
+    """
+    How many points equations have been evaluated at so far this frame.
+    """
+    _keys: int
+    """
+    How many keys have been handled so far this frame, there can be many when keys arrive faster than frames are drawn.
+    """
+    _last_frame: dict | None
+    """
+    The record of the last frame that ended.
+    """
+    _frame_count: int
+    _frame_start: float
+    """
+    When the current frame started, from time.perf_counter.
+    """
+    _export_path: str | None
+    _export_file: any  # Opened when the first frame ends
+    _lock: threading.Lock
+    """
+    Sections may be recorded from render threads as well as the main thread.
+    """
+
+    def __init__(self, export_path: str | None = None):
+        """
+        Creates a profiler, that writes every frame to the given file if a path is given.
+        """
+        self._sections = collections.defaultdict(float)
+        self._evaluations = 0
+        self._keys = 0
+        self._last_frame = None
+        self._frame_count = 0
+        self._frame_start = time.perf_counter()
+        self._export_path = export_path
+        self._export_file = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def section(self, name: str):
+        """
+        Time the code run inside this context manager, adding it to the section with the given name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self._sections[name] += duration
+
+    def add_evaluations(self, count: int):
+        with self._lock:
+            self._evaluations += count
+
+    def add_keys(self, count: int):
+        with self._lock:
+            self._keys += count
+
+    def get_evaluations(self) -> int:
+        """
+        How many evaluations have been added so far this frame.
+        """
+        with self._lock:
+            return self._evaluations
+
+    def start_frame(self):
+        """
+        Start timing a new frame, anything recorded since the last frame ended is counted in this one.
+        """
+        self._frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """
+        Finish the current frame, storing it for the summary and exporting it.
+        Sections can overlap (e.g. an equation being rendered while a widget draws), so the frame's duration is timed
+        separately rather than being their total.
+        """
+        with self._lock:
+            self._last_frame = {"frame": self._frame_count, "duration": time.perf_counter() - self._frame_start,
+                                "sections": dict(self._sections), "evaluations": self._evaluations, "keys": self._keys}
+            self._sections.clear()
+            self._evaluations = 0
+            self._keys = 0
+            self._frame_count += 1
+
+        if self._export_path is not None:
+            if self._export_file is None:
+                self._export_file = open(self._export_path, "w")
+            self._export_file.write(json.dumps(self._last_frame) + "\n")
+
+    def get_summary(self, section_count: int = 2) -> str:
+        """
+        A short description of the last frame, with its total time, the slowest sections and how many evaluations and
+        keys there were.
+        """
+        if self._last_frame is None:
+            return ""
+        sections = self._last_frame["sections"]
+        slowest = sorted(sections.items(), key=lambda item: -item[1])[:section_count]
+        return " ".join([f"frame {self._last_frame['duration'] * 1000:.1f}ms"] +
+                        [f"{name} {duration * 1000:.1f}ms" for name, duration in slowest] +
+                        [f"evals {self._last_frame['evaluations']}", f"keys {self._last_frame['keys']}"])
+
+    def close(self):
+        if self._export_file is not None:
+            self._export_file.close()
+            self._export_file = None
+
+
+_active: Profiler | None = None
+"""
+The profiler that the functions below record to, or None to not record anything.
+"""
+
+
+def set_active(profiler: Profiler | None):
+    """
+    Set the profiler that section and add_evaluations record to.
+    """
+    global _active
+    _active = profiler
+
+
+def get_active() -> Profiler | None:
+    return _active
+
+
+def section(name: str):
+    """
+    Time a section on the active profiler, or do nothing if there isn't one.
+    """
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.section(name)
+
+
+def add_evaluations(count: int):
+    """
+    Count evaluations on the active profiler, or do nothing if there isn't one.
+    """
+    if _active is not None:
+        _active.add_evaluations(count)
+
+
+def add_keys(count: int):
+    """
+    Count keys on the active profiler, or do nothing if there isn't one.
+    """
+    if _active is not None:
+        _active.add_keys(count)
@@ -0,0 +1,151 @@
+import json
+import mmap
+import os
+import struct
+
+from layer import Layer
+
+MAGIC = b"CGPSESS1"
+"""
+The first bytes of every session file, the last character is the version of the format.
+"""
+_FOOTER = struct.Struct("<Q")  # Where the metadata starts, as the last bytes of the file
+
+
+class Session:
+    """
+    A saved session, as loaded by load_session.
+    Layers are read from a memory map of the file, so nothing is read until it is needed.
+    """
+
+    equations: list[tuple[str, str]]
+    view: dict
+    """
+    The state of the GraphViewer, from GraphViewer.get_view_state.
+    """
+    tiles: "MappedTiles"
+    last_frame: tuple[list, Layer] | None
+    """
+    The fields of the request of the last frame that was drawn, and its layer, or None if nothing had been drawn.
+    """
+
+    def __init__(self, equations: list[tuple[str, str]], view: dict, tiles: "MappedTiles", last_frame: tuple[list, Layer] | None):
+        self.equations = equations
+        self.view = view
+        self.tiles = tiles
+        self.last_frame = last_frame
+
+
+class MappedTiles:
+    """
+    The tiles of a session file, which are read from a memory map of it when asked for.
+    This can be given to a TileCache as its stored tiles.
+    """
+
+    _map: mmap.mmap
+    _tiles: dict[tuple, tuple[int, int, int]]
+    """
+    The (offset, width, height) of the layer of each tile key in the map.
+    """
+
+    def __init__(self, file_map: mmap.mmap, tiles: dict[tuple, tuple[int, int, int]]):
+        self._map = file_map
+        self._tiles = tiles
+
+    def keys(self) -> list[tuple]:
+        return list(self._tiles)
+
+    def get(self, key) -> Layer | None:
+        if key not in self._tiles:
+            return None
+        return _read_layer(self._map, *self._tiles[key])
+
+
+def _layer_size(width: int, height: int) -> int:
+    """
+    How many bytes a layer takes in a session file, which is each row as a little endian int of whole bytes.
+    """
+    return (width + 7) // 8 * height
+
+
+def _layer_fits(offset, width, height, end: int) -> bool:
+    """
+    True if a layer's position and size are whole numbers, and it is stored between MAGIC and end.
+    """
+    return all(type(value) is int and value >= 0 for value in (offset, width, height)) and \
+        len(MAGIC) <= offset and offset + _layer_size(width, height) <= end
+
+
+def _write_layer(file, layer: Layer):
+    row_size = (layer.width + 7) // 8
+    file.write(b"".join(row.to_bytes(row_size, "little") for row in layer.rows))
+
+
+def _read_layer(file_map: mmap.mmap, offset: int, width: int, height: int) -> Layer:
+    row_size = (width + 7) // 8
+    return Layer(width, height, [int.from_bytes(file_map[start:start + row_size], "little")
+                                 for start in range(offset, offset + row_size * height, row_size)])
+
+
+def save_session(path: str, equations: list[tuple[str, str]], view: dict, tiles, last_frame: tuple[list, Layer] | None):
+    """
+    Save a session to the given path.
+    tiles is an iterable of (key, layer), from TileCache.get_tiles, only tiles of the given equations are saved.
+    The layers are written as they come, and the metadata that says where they are is written after them.
+    The file is written next to the path and then moved over it, so a session that is being read from isn't changed.
+    """
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(MAGIC)
+        metadata = {"equations": [list(source) for source in equations], "view": view, "tiles": [], "last_frame": None}
+
+        for key, layer in tiles:
+            if key[0] in equations:
+                metadata["tiles"].append([*key[0], *key[1:], file.tell(), layer.width, layer.height])
+                _write_layer(file, layer)
+
+        if last_frame is not None:
+            metadata["last_frame"] = [last_frame[0], file.tell(), last_frame[1].width, last_frame[1].height]
+            _write_layer(file, last_frame[1])
+
+        metadata_start = file.tell()
+        file.write(json.dumps(metadata).encode())
+        file.write(_FOOTER.pack(metadata_start))
+    os.replace(temporary_path, path)
+
+
+def load_session(path: str) -> Session | None:
+    """
+    Load the session saved at the given path, or return None if there isn't a valid one.
+    """
+    try:
+        with open(path, "rb") as file:
+            file_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)  # This stays valid after the file is closed
+    except (OSError, ValueError):  # Doesn't exist, or is empty
+        return None
+
+    try:
+        if file_map[:len(MAGIC)] != MAGIC:
+            return None
+        metadata_start, = _FOOTER.unpack(file_map[-_FOOTER.size:])
+        metadata = json.loads(file_map[metadata_start:-_FOOTER.size].decode())
+
+        tiles = {}
+        for lhs, rhs, *key, offset, width, height in metadata["tiles"]:
+            if not _layer_fits(offset, width, height, metadata_start):
+                return None
+            tiles[((lhs, rhs), *key)] = (offset, width, height)
+
+        last_frame = None
+        if metadata["last_frame"] is not None:
+            request, offset, width, height = metadata["last_frame"]
+            if not isinstance(request, list) or not _layer_fits(offset, width, height, metadata_start):
+                return None
+            last_frame = (request, _read_layer(file_map, offset, width, height))
+
+        if not isinstance(metadata["view"], dict):
+            return None
+        equations = [(str(lhs), str(rhs)) for lhs, rhs in metadata["equations"]]
+        return Session(equations, metadata["view"], MappedTiles(file_map, tiles), last_frame)
+    except (struct.error, ValueError, TypeError, KeyError):  # Cut off or not written by us
+        return None
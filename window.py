@@ -1,11 +1,67 @@
+import collections
+import concurrent.futures
 import curses
+import math
+import re
+import time
 import typing
 
+import profiling
+
 BLACK = curses.COLOR_BLACK
 WHITE = curses.COLOR_WHITE
 
 DOWN_ARROW = curses.KEY_DOWN
 UP_ARROW = curses.KEY_UP
+LEFT_ARROW = curses.KEY_LEFT
+RIGHT_ARROW = curses.KEY_RIGHT
+NO_KEY = curses.ERR  # What getch returns if no key was pressed before it timed out
+
+BUSY_REFRESH_INTERVAL = 50
+"""
+How many milliseconds to wait for a key before drawing again, while any widget is busy.
+"""
+MAX_FRAME_RATE = 60
+"""
+The most frames a second the window draws, keys pressed between frames are all handled in the next one.
+"""
+FRAME_RATE_SAMPLE_SIZE = 30
+"""
+How many of the latest frames the frame rate in get_frame_stats is measured over.
+"""
+REDRAW_STATIC = "static"
+"""
+Refresh policy for widgets that never change, these are only drawn on the first frame and after the screen is cleared.
+"""
+REDRAW_ON_RESIZE = "on resize"
+"""
+Refresh policy for widgets that only change with the size of the window.
+"""
+REDRAW_ON_CHANGE = "on change"
+"""
+Refresh policy for widgets that are drawn whenever their needs_redraw returns True.
+"""
+REDRAW_ON_TIMER = "on timer"
+"""
+Refresh policy for widgets that are drawn every get_refresh_interval milliseconds.
+"""
+
+KEY_CODE_WIDTH = 4
+"""
+How many characters the last key code shown in the bottom right is padded to.
+"""
+PROFILE_SUMMARY_WIDTH = 60
+"""
+How many characters the profiler summary shown in the top right is padded to.
+"""
+
+
+def rectangles_overlap(a: tuple[int, int, int, int], b: tuple[int, int, int, int]) -> bool:
+    """
+    True if the two (x, y, width, height) rectangles share any cells.
+    """
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
 
 class Widget:
     """
@@ -43,6 +99,61 @@ class Widget:
         """
         raise NotImplemented()
 
+    def get_refresh_policy(self) -> str:
+        """
+        When this widget should be drawn again, one of REDRAW_STATIC, REDRAW_ON_RESIZE, REDRAW_ON_CHANGE or REDRAW_ON_TIMER.
+        Whatever the policy, a widget is also drawn when one that overlaps it is, and every widget is drawn on a resize.
+        """
+        return REDRAW_ON_CHANGE
+
+    def get_refresh_interval(self) -> int:
+        """
+        How many milliseconds apart a widget with the REDRAW_ON_TIMER policy is drawn.
+        """
+        return 1000
+
+    def needs_redraw(self, window: "Window") -> bool:
+        """
+        True if this widget would draw something different to what it drew last time, this is only used for widgets
+        with the REDRAW_ON_CHANGE policy.
+        Widgets that return False are not drawn, and what they drew last is left on the screen.
+        """
+        return True
+
+    def get_region(self, window: "Window") -> tuple[int, int, int, int]:
+        """
+        The rectangle this widget draws in, as (x, y, width, height).
+        When a widget is redrawn, any other widget whose region overlaps it is redrawn too.
+        """
+        return 0, 0, window.get_size()[0], window.get_size()[1]
+
+    def is_busy(self) -> bool:
+        """
+        True if this widget is waiting on work outside the event loop, so should be drawn again soon even if no key is
+        pressed.
+        """
+        return False
+
+    def is_taking_text(self) -> bool:
+        """
+        True if keys pressed while this widget is focussed are being typed into it, so q is passed to it rather than
+        quitting.
+        """
+        return False
+
+    def has_pending_work(self) -> bool:
+        """
+        True if this widget has work that the window should run in small pieces with do_pending_work, whenever it is
+        waiting for a key.
+        """
+        return False
+
+    def do_pending_work(self):
+        """
+        Do the next small piece of this widget's pending work. This should return quickly so keys are still handled.
+        """
+        pass
+
 
 class Window:
     """
@@ -51,10 +162,16 @@ class Window:
 
     This stores a list of widgets. Each frame,
         1. The key event is checked.
-            a. If q is pressed then the application exits.
+            a. If q is pressed then the application exits, unless the focussed widget is_taking_text.
             b. If the focus is changed then the respective widget's focus and un-focus methods will be called.
-        2. Each widget's call function will be executed with this Window object as its parameter.
+            c. If no key was pressed, then widgets with pending work do the next piece of it.
+        2. Each widget that needs redrawing will have its draw function executed with this Window object as its parameter.
             a. These can then call the window's various drawing functions to complete their task.
+            b. Only widgets that are due under their refresh policy are drawn, along with any they overlap, or all of
+               them if the window was resized.
+            c. If a frame budget is given and drawing goes over it, the widgets that are left are drawn next frame.
+        3. Only the parts of the screen that were drawn to are sent to the terminal.
+        4. Then it waits for a key, but only until the next widget is due to be drawn.
 
     The drawing functions of this window should be safe (checking window edges) as well as working in (columns, rows).
     """
@@ -75,17 +192,67 @@ class Window:
     The key is the (fg, bg), the value is the attribute id.
     Values be unique, and consecutive when ordered, counting from one.
     """
+    _current_color: tuple[int, int] | None
+    """
+    The (fg, bg) that is currently set, so setting it again can be skipped.
+    """
+    _process_count: int | None
+    """
+    How many processes widgets may render in, or None to not have a process pool.
+    """
+    _executor: concurrent.futures.ProcessPoolExecutor | None  # Only exists while mainloop is running
+    _profiler: profiling.Profiler | None
+    """
+    If given, this times each part of every frame and its summary is shown in the top right.
+    """
+    _frame_budget: int | None
+    """
+    How many milliseconds a frame may spend drawing widgets before the rest are left for the next frame, None for no limit.
+    """
+    _last_drawn: dict[Widget, float]
+    """
+    When each widget was last drawn, from time.perf_counter.
+    """
+    _deferred: list[Widget]
+    """
+    The widgets that were due but left over when the last frame ran out of budget.
+    """
+    _frame_times: collections.deque
+    """
+    When each of the latest frames was drawn, from time.perf_counter.
+    """
+    _frame_count: int
+    _key_count: int
+    _coalesced_key_count: int
+    """
+    How many keys were handled in the same frame as an earlier key, rather than getting a frame of their own.
+    """
 
 
-    def __init__(self, widgets: tuple[Widget]):
+    def __init__(self, widgets: tuple[Widget], process_count: int | None = None, profiler: profiling.Profiler | None = None, frame_budget: int | None = None):
         """
         Creates a new window with the given widgets.
         The first widget in the given collection will start focussed.
+        If a process_count is given then a process pool of that size is available to widgets while the mainloop runs.
+        If a profiler is given then it is made active while the mainloop runs.
+        If a frame_budget is given then each frame stops drawing widgets once it has taken that many milliseconds, at
+        least one widget is always drawn.
         """
         self._widgets = tuple(widgets)
         self._current_focus = 0
         self._stdscr = None  # Initialised later
         self._color_pairs = {}
+        self._current_color = None
+        self._process_count = process_count
+        self._executor = None
+        self._profiler = profiler
+        self._frame_budget = frame_budget
+        self._last_drawn = {}
+        self._deferred = []
+        self._frame_times = collections.deque(maxlen=FRAME_RATE_SAMPLE_SIZE)
+        self._frame_count = 0
+        self._key_count = 0
+        self._coalesced_key_count = 0
 
 
     def _mainloop(self, stdscr):
@@ -101,41 +268,193 @@ class Window:
         stdscr.refresh()
 
         self._stdscr = stdscr
+        self._current_color = None  # Nothing has been set on this screen yet
 
-        last_key = 0  # The last key that was pressed
+        keys = []  # The keys pressed since the last frame
+        shown_key = 0  # The last key that was pressed
+        self._size = None
 
         while True:
-            stdscr.clear()
-            self._size = stdscr.getmaxyx()
-            stdscr.attron
+            # We don't clear the screen each frame, so curses only sends the terminal what has changed.
+            resized = stdscr.getmaxyx() != self._size
+            if resized:
+                stdscr.erase()
+                self._size = stdscr.getmaxyx()
 
             # Handle events
-            if last_key == ord("q"):
+            quitting = False
+            with profiling.section("events"):
+                if not keys:  # We only woke up to draw again, so carry on with any work
+                    for widget in self._widgets:
+                        if widget.has_pending_work():
+                            widget.do_pending_work()
+                for key in keys:  # Every key since the last frame changes the state, and then it is drawn once
+                    if key == ord("q") and not self._widgets[self._current_focus].is_taking_text():
+                        quitting = True
+                        break
+                    if key == ord("\t"):
+                        self._current_focus = (self._current_focus + 1) % len(self._widgets)
+                    else:
+                        self._widgets[self._current_focus].handle_key(key)
+
+            if quitting:
                 break
-            elif last_key == ord("\t"):
-                self._current_focus = (self._current_focus + 1) % len(self._widgets)
-            else:
-                self._widgets[self._current_focus].handle_key(last_key)
 
             # Draw widgets
-            for widget in self._widgets:
-                widget.draw(self)
+            self._draw_widgets(self._get_damaged_widgets(resized))
 
-            # Write the current key code to the bottom right
+            # Write the current key code to the bottom right, padded so it covers the last one
             self._set_color(BLACK, WHITE)
-            self._stdscr.addstr(self._size[0] - 1, self._size[1] - len(str(last_key)) - 2, str(last_key))
+            if keys:
+                shown_key = keys[-1]
+            self._stdscr.addstr(self._size[0] - 1, self._size[1] - KEY_CODE_WIDTH - 2, str(shown_key).rjust(KEY_CODE_WIDTH))
+
+            # And the last frame's timings to the top right
+            if self._profiler is not None:
+                width = min(PROFILE_SUMMARY_WIDTH, self._size[1] - 1)
+                self._stdscr.addstr(0, self._size[1] - width - 1, self._profiler.get_summary()[:width].rjust(width))
 
 
             # Update the screen
-            stdscr.refresh()
-            last_key = stdscr.getch()
+            with profiling.section("refresh"):
+                stdscr.noutrefresh()
+                curses.doupdate()
+            self._frame_times.append(time.perf_counter())
+            self._frame_count += 1
+            self._key_count += len(keys)
+            self._coalesced_key_count += max(0, len(keys) - 1)
+            profiling.add_keys(len(keys))
+            if self._profiler is not None:
+                self._profiler.end_frame()
+
+            keys = self._get_keys()
+            if self._profiler is not None:
+                self._profiler.start_frame()
+
+    def _draw_widgets(self, widgets: list[Widget]):
+        """
+        Draw the given widgets in order, leaving any that don't fit in the frame budget for the next frame.
+        """
+        start = time.perf_counter()
+        for n, widget in enumerate(widgets):
+            if n > 0 and self._frame_budget is not None and (time.perf_counter() - start) * 1000 >= self._frame_budget:
+                self._deferred = widgets[n:]
+                return
+            with profiling.section("draw " + type(widget).__name__):
+                widget.draw(self)
+            self._last_drawn[widget] = time.perf_counter()
+        self._deferred = []
 
+    def _get_timeout(self) -> int:
+        """
+        How many milliseconds to wait for a key before the next frame is due anyway, or -1 to wait until there is one.
+        """
+        if self._deferred or any(widget.has_pending_work() for widget in self._widgets):
+            return 0  # Just check for a key, as there is more to do straight away
+        timeouts = []
+        if any(widget.is_busy() for widget in self._widgets):
+            timeouts.append(BUSY_REFRESH_INTERVAL)  # Busy widgets need drawing again once their work finishes
+        for widget in self._widgets:
+            if widget.get_refresh_policy() == REDRAW_ON_TIMER and widget in self._last_drawn:
+                due = self._last_drawn[widget] + widget.get_refresh_interval() / 1000
+                timeouts.append(max(0, math.ceil((due - time.perf_counter()) * 1000)))
+        return min(timeouts, default=-1)
+
+    def _get_keys(self) -> list[int]:
+        """
+        Wait until the next frame should be drawn, and return the keys pressed until then.
+        This waits for a key for up to _get_timeout. Any keys that are already queued (e.g. from holding an arrow key or
+        pasting) are taken too, and if it is too soon for another frame under MAX_FRAME_RATE then keys keep being taken
+        until it isn't.
+        """
+        self._stdscr.timeout(self._get_timeout())
+        key = self._stdscr.getch()
+        keys = [] if key == NO_KEY else [key]
+
+        while True:
+            wait = self._frame_times[-1] + 1 / MAX_FRAME_RATE - time.perf_counter()
+            self._stdscr.timeout(max(0, math.ceil(wait * 1000)))
+            key = self._stdscr.getch()
+            if key != NO_KEY:
+                keys.append(key)
+            elif wait <= 0:
+                return keys
+
+    def get_frame_stats(self) -> dict[str, float]:
+        """
+        Returns how the mainloop has been keeping up, with
+            frame_rate: the frames per second over the latest frames,
+            frames: how many frames have been drawn,
+            keys: how many keys have been handled,
+            coalesced_keys: how many of those keys were handled in the same frame as an earlier one.
+        """
+        frame_rate = 0.0
+        if len(self._frame_times) > 1 and self._frame_times[-1] > self._frame_times[0]:
+            frame_rate = (len(self._frame_times) - 1) / (self._frame_times[-1] - self._frame_times[0])
+        return {"frame_rate": frame_rate, "frames": self._frame_count, "keys": self._key_count, "coalesced_keys": self._coalesced_key_count}
+
+
+    def _is_due(self, widget: Widget) -> bool:
+        """
+        True if the given widget should be drawn this frame under its refresh policy.
+        """
+        if widget in self._deferred or widget not in self._last_drawn:
+            return True
+        policy = widget.get_refresh_policy()
+        if policy == REDRAW_ON_CHANGE:
+            return widget.needs_redraw(self)
+        if policy == REDRAW_ON_TIMER:
+            return time.perf_counter() - self._last_drawn[widget] >= widget.get_refresh_interval() / 1000
+        return False  # Static and on resize widgets are drawn on every resize anyway
+
+    def _get_damaged_widgets(self, resized: bool) -> list[Widget]:
+        """
+        Returns the widgets that need drawing this frame, in the order they should be drawn.
+        This is every widget if the window was resized, otherwise those that are due and any that overlap them.
+        """
+        if resized:
+            return list(self._widgets)
+
+        damaged = [self._is_due(widget) for widget in self._widgets]
+        regions = [widget.get_region(self) for widget in self._widgets]
+        changed = True
+        while changed:  # Keep going as a widget we have just added may overlap another
+            changed = False
+            for n, region in enumerate(regions):
+                if not damaged[n] and any(damaged[m] and rectangles_overlap(region, regions[m]) for m in range(len(regions))):
+                    damaged[n] = True
+                    changed = True
+        return [widget for widget, is_damaged in zip(self._widgets, damaged) if is_damaged]
 
     def mainloop(self):
         """
         Hand control of the console and events and drawing to the window and then enter the main event loop.
+        The process pool, if there is one, is started before and shut down after.
         """
-        curses.wrapper(self._mainloop)
+        if self._process_count is not None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(self._process_count)
+        profiling.set_active(self._profiler)
+        try:
+            curses.wrapper(self._mainloop)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+            if self._profiler is not None:
+                profiling.set_active(None)
+                self._profiler.close()
+
+    def get_executor(self) -> concurrent.futures.ProcessPoolExecutor | None:
+        """
+        Returns the process pool widgets can render in, or None if there isn't one.
+        """
+        return self._executor
+
+    def get_process_count(self) -> int:
+        """
+        Returns how many processes are in the process pool, this is 1 if there isn't one.
+        """
+        return self._process_count if self._executor is not None else 1
 
     def get_widgets(self) -> tuple[Widget]:
         return self._widgets
@@ -168,8 +487,8 @@ class Window:
         self._set_color(foreground_color, background_color)  # Set the color we want
 
         self.draw_rectangle(x, y, width, height // 2)  # Draw the bar before the line with text on it
-        self._stdscr.addstr(y + height // 2, x, " " * width)  # First draw bar
-        self._stdscr.addstr(y + height // 2, x + (width - len(text)) // 2, text)  # Then overlay our text
+        left_padding = (width - len(text)) // 2
+        self._stdscr.addstr(y + height // 2, x, " " * left_padding + text + " " * (width - left_padding - len(text)))  # Draw the bar with our text in it
         self.draw_rectangle(x, y + height // 2 + 1, width, height // 2 - 1)  # Draw the bar after the line with text on it
 
     def draw_rectangle(self, x, y, width, height, color=None):
@@ -185,7 +504,7 @@ class Window:
         if color is not None:
             self._set_color(WHITE, color)
 
-        for row in range(y, y + height):  # Draw the bar before the line with text on it
+        for row in range(y, y + height):
             self._stdscr.addstr(row, x, " " * width)
 
     def _set_color(self, foreground_color, background_color):
@@ -194,10 +513,19 @@ class Window:
         This will reuse color pairs if it can, otherwise it will create a new pair.
         """
         color = (foreground_color, background_color)
+        if color == self._current_color:
+            return  # Already set, so don't send it again
+        self._stdscr.attron(self._get_color_attribute(color))
+        self._current_color = color
+
+    def _get_color_attribute(self, color: tuple[int, int]) -> int:
+        """
+        Returns the attribute that draws with the given (fg, bg), creating a color pair for it if there isn't one.
+        """
         if color not in self._color_pairs:
-            curses.init_pair(len(self._color_pairs) + 1, foreground_color, background_color)
+            curses.init_pair(len(self._color_pairs) + 1, color[0], color[1])
             self._color_pairs[color] = len(self._color_pairs) + 1
-        self._stdscr.attron(curses.color_pair(self._color_pairs[color]))
+        return curses.color_pair(self._color_pairs[color])
 
     def draw_text(self, x, y, text, foreground_color, background_color):
         """
@@ -216,6 +544,7 @@ class Window:
         """
         Overlays the given text ontop of what is already there.
         This ignores spaces, but will overwrite other characters.
+        Each run of characters between spaces is drawn at once.
         """
         assert 0 <= x, "Area overlaps left border"
         assert 0 <= y, "Area overlaps top border"
@@ -225,7 +554,6 @@ class Window:
         for line in text:
             assert "\n" not in line#
             assert x + len(line) <= self._size[1], f"Area overlaps right border {x, len(text)}"
-            for n, char in enumerate(line):
-                if char != " ":
-                    self._stdscr.addch(y, x + n, char)
+            for run in re.finditer("[^ ]+", "".join(line)):
+                self._stdscr.addstr(y, x + run.start(), run.group())
             y += 1
\ No newline at end of file